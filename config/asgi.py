@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+# Route the calculator API to its native async views
+os.environ.setdefault("KCALC_ASYNC_VIEWS", "1")
 
 application = get_asgi_application()
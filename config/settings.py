@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -40,6 +41,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "kcalc.timing.TimingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -76,6 +78,18 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # Tests use a file too: threads of the concurrency tests need SQLite's busy
+        # timeout, which the shared in-memory test database does not have
+        "TEST": {"NAME": BASE_DIR / "test_db.sqlite3"},
+    }
+}
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
     }
 }
 
@@ -118,3 +132,89 @@ STATICFILES_DIRS = [BASE_DIR / 'static']
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+# Calculator engine
+# Number of compiled expressions kept in the in-process LRU cache (0 disables it)
+
+KCALC_EXPRESSION_CACHE_SIZE = 1024
+
+# Upper bound on the point budget a single graph request may ask for
+KCALC_GRAPH_MAX_POINTS = 100000
+
+# Request bodies up to 32 MB, enough for a 1000x1000 matrix as JSON or base64
+DATA_UPLOAD_MAX_MEMORY_SIZE = 32 * 1024 * 1024
+
+# Maximum number of calculations accepted by /api/calculate/batch/
+KCALC_BATCH_MAX_ITEMS = 1000
+# Seconds a batch may spend on its calculations; items not started by then
+# fail in place. With the evaluation sandbox the running item is also cut
+# off at the deadline, in process it finishes first
+KCALC_BATCH_TIMEOUT = 30.0
+
+# Rows fetched per database round trip and per streamed chunk when exporting history
+KCALC_EXPORT_CHUNK_SIZE = 2000
+
+# Cache alias and lifetime (seconds) for per-user preferences; use a shared
+# backend such as Redis when running several worker processes
+KCALC_PREFERENCES_CACHE = 'default'
+KCALC_PREFERENCES_CACHE_TIMEOUT = 300
+
+# How calculation history is written: 'sync' inserts each row inside the
+# request; 'buffered' queues rows in-process and writes them in batches once
+# KCALC_HISTORY_FLUSH_SIZE rows are queued or KCALC_HISTORY_FLUSH_INTERVAL
+# seconds have passed, trading up to that much history on a crash for fewer
+# write transactions. Queued rows are flushed on a clean shutdown.
+KCALC_HISTORY_DURABILITY = 'sync'
+KCALC_HISTORY_FLUSH_SIZE = 100
+KCALC_HISTORY_FLUSH_INTERVAL = 1.0
+# Past this many queued rows, requests write the queue out themselves
+KCALC_HISTORY_MAX_PENDING = 10000
+# Matrix results with more cells than this are recorded in the history by
+# shape only, e.g. "1000x1000 matrix", like binary matrix results
+KCALC_HISTORY_MAX_CELLS = 100
+
+# Serve the calculator API from async views; config.asgi turns this on
+KCALC_ASYNC_VIEWS = os.environ.get('KCALC_ASYNC_VIEWS') == '1'
+# Threads running expression evaluation for the async views (None: Python's default)
+KCALC_EVALUATION_WORKERS = None
+
+# Evaluate calculations in a pool of worker processes, so runaway inputs
+# such as factorial(10**6) are killed after KCALC_SANDBOX_TIMEOUT seconds
+# or fail at KCALC_SANDBOX_MEMORY_LIMIT bytes of address space instead of
+# stalling the web worker. Off unless KCALC_EVALUATION_SANDBOX=1 is set in
+# the environment: when on, every web process starts KCALC_SANDBOX_WORKERS
+# spawned processes, each importing Django and NumPy
+KCALC_EVALUATION_SANDBOX = os.environ.get('KCALC_EVALUATION_SANDBOX') == '1'
+KCALC_SANDBOX_WORKERS = None  # None: one per CPU, at least two
+KCALC_SANDBOX_TIMEOUT = 2.0
+# Per calculation type timeouts overriding KCALC_SANDBOX_TIMEOUT, e.g. for
+# large sparse matrices
+KCALC_SANDBOX_TIMEOUTS = {'matrix': 10.0}
+KCALC_SANDBOX_MEMORY_LIMIT = 1024 * 1024 * 1024
+
+# Static cost limits checked when an expression is compiled: integer results
+# (powers, factorials, products, sums, ...) that would exceed
+# KCALC_MAX_RESULT_BITS bits are refused ('refuse') or computed in floating
+# point ('approximate'), and parentheses, calls and exponents may nest at
+# most KCALC_MAX_EXPRESSION_DEPTH deep
+KCALC_MAX_RESULT_BITS = 100000
+KCALC_MAX_EXPRESSION_DEPTH = 200
+KCALC_EXPENSIVE_EXPRESSIONS = 'refuse'
+
+# Results needing more digits than a float holds (integer digits plus
+# decimal_places beyond 15) are recomputed with Decimal, up to this many
+# significant digits
+KCALC_MAX_PRECISION = 1000
+
+# Sparse matrices ({'format': 'coo' or 'csr', ...} matrix_data) are expanded
+# to dense arrays of up to this many cells for operations without a sparse
+# algorithm (rank, and solve when SciPy is not installed)
+KCALC_SPARSE_DENSE_LIMIT = 4000000
+# Largest declared number of rows or columns of a sparse matrix
+KCALC_SPARSE_MAX_DIMENSION = 1000000
+
+# Time each request by stage (parse, evaluate, matrix, graph, format, db,
+# encode, ...), report the stages in a Server-Timing header and aggregate
+# p50/p95/p99 per endpoint, calculation type and action at /api/timing/.
+# When off, kcalc.timing.TimingMiddleware removes itself from the chain
+KCALC_TIMING = os.environ.get('KCALC_TIMING') == '1'
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class KcalcConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "kcalc"
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from .timing import install_query_wrapper, timing_enabled
+
+        if timing_enabled():
+            connection_created.connect(install_query_wrapper)
@@ -0,0 +1,335 @@
+import ast
+import math
+import operator
+import threading
+from collections import OrderedDict
+
+# Map Python AST operator nodes onto the symbols used in AdvancedCalculator.OPERATORS
+BINARY_OPERATOR_SYMBOLS = {
+    ast.Add: '+',
+    ast.Sub: '-',
+    ast.Mult: '*',
+    ast.Div: '/',
+    ast.FloorDiv: '//',
+    ast.Mod: '%',
+    ast.Pow: '**',
+}
+
+UNARY_OPERATORS = {
+    ast.UAdd: operator.pos,
+    ast.USub: operator.neg,
+}
+
+# Floats never exceed 2**1024, so only exact integer arithmetic can grow without bound
+FLOAT_BITS = 1024
+
+# Functions whose results stay small whatever their (valid) argument, in radians or degrees
+BOUNDED_FUNCTIONS = {'sin', 'cos', 'tanh', 'asin', 'acos', 'atan'}
+LOG_FUNCTIONS = {'log', 'ln'}
+# Functions returning their argument's magnitude, rounded to an integer for the last three
+MAGNITUDE_FUNCTIONS = {'abs', 'min', 'max', 'ceil', 'floor', 'round'}
+INTEGER_FUNCTIONS = {'ceil', 'floor', 'round'}
+
+
+def normalize_expression(expression):
+    """Normalize display symbols so the expression can be parsed"""
+    # '^' is rewritten to '**' up front, Python's own '^' binds too loosely
+    return expression.replace('×', '*').replace('÷', '/').replace('^', '**').strip()
+
+
+def parse_expression(expression):
+    """Parse a normalized expression into an AST node"""
+    try:
+        return ast.parse(expression, mode='eval').body
+    except SyntaxError as e:
+        raise ValueError(f"Invalid syntax: {e.msg}")
+    except RecursionError:
+        raise ValueError("Expression is too long to parse")
+
+
+def binary_chain(node):
+    """Split a left-nested run of binary operations such as 1+2-3*4 into (first operand, [BinOp, ...])
+
+    The AST nests once per operator of such a run, so it is walked as a
+    loop instead of by recursion, and does not count as nesting.
+    """
+    steps = []
+    while isinstance(node, ast.BinOp):
+        steps.append(node)
+        node = node.left
+    steps.reverse()
+    return node, steps
+
+
+def check_expression_cost(node, max_bits, max_depth, approximate=False):
+    """Estimate what evaluating a parsed expression costs, without evaluating it
+
+    Tracks an upper bound on log2 of every sub-expression's magnitude. Only
+    exact integer arithmetic can push that past float range, and its cost
+    grows with it. Integer results above max_bits raise ValueError, or with
+    approximate=True are marked to be computed in floating point instead
+    (see compile_expression). Names are assumed to be floats. Nesting
+    deeper than max_depth (parentheses, calls, exponents) is refused.
+    """
+    return expression_size(node, max_bits, max_depth, approximate, 1)[0]
+
+
+def expression_size(node, max_bits, max_depth, approximate, depth):
+    """Return (log2 magnitude bound, is_int) for a node, see check_expression_cost"""
+    if depth > max_depth:
+        raise ValueError(f"Expression is nested too deeply (limit {max_depth})")
+
+    def size(child):
+        return expression_size(child, max_bits, max_depth, approximate, depth + 1)
+
+    if isinstance(node, ast.Constant):
+        value = node.value
+        if isinstance(value, int) and not isinstance(value, bool):
+            return (math.log2(abs(value)) if value else 0.0), True
+        if isinstance(value, float) and math.isfinite(value) and value:
+            return max(math.log2(abs(value)), 0.0), False
+        return 0.0, False
+
+    if isinstance(node, ast.UnaryOp):
+        return size(node.operand)
+
+    if isinstance(node, ast.BinOp):
+        first, steps = binary_chain(node)
+        bits, is_int = size(first)
+        for step in steps:
+            right, right_int = size(step.right)
+            bits, is_int = binary_size(step, bits, is_int, right, right_int, max_bits, approximate)
+        return bits, is_int
+
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+        name = node.func.id
+        args = [size(arg) for arg in node.args]
+        bits = max((bits for bits, _ in args), default=0.0)
+
+        if name == 'factorial' and args and args[0][1]:
+            # log2(n!) <= n * log2(n), and n <= 2 ** bits
+            bits = bits * 2.0 ** bits if bits < FLOAT_BITS else math.inf
+            return limit_size(node, bits, max_bits, approximate)
+        if name in BOUNDED_FUNCTIONS:
+            return 7.0, False
+        if name in LOG_FUNCTIONS:
+            return math.log2(bits + 1) + 1, False
+        if name == 'sqrt':
+            return bits / 2 + 1, False
+        if name in MAGNITUDE_FUNCTIONS:
+            is_int = name in INTEGER_FUNCTIONS or all(arg_int for _, arg_int in args)
+            return (bits if is_int else min(bits, FLOAT_BITS)), is_int
+
+    # Names and any other float-valued function stay within float range
+    for child in ast.iter_child_nodes(node):
+        size(child)
+    return float(FLOAT_BITS), False
+
+
+def binary_size(node, left, left_int, right, right_int, max_bits, approximate):
+    """(log2 magnitude bound, is_int) of a binary operation on operands of the given bounds"""
+    is_int = left_int and right_int
+    op = type(node.op)
+    if op is ast.Pow:
+        # log2|a ** b| = log2|a| * |b|, and |b| <= 2 ** right
+        bits = left * 2.0 ** right if right < FLOAT_BITS else math.inf
+    elif op in (ast.Add, ast.Sub):
+        bits = max(left, right) + 1
+    elif op is ast.Mult:
+        bits = left + right
+    elif op is ast.FloorDiv:
+        bits = left
+    elif op is ast.Mod:
+        bits = right
+    else:
+        bits, is_int = FLOAT_BITS, False
+
+    if is_int:
+        return limit_size(node, bits, max_bits, approximate)
+    if approximate and max(left if left_int else 0, right if right_int else 0) > FLOAT_BITS:
+        # Mixing floats with an integer beyond float range would overflow
+        node.approximate = True
+    return min(bits, FLOAT_BITS), False
+
+
+def limit_size(node, bits, max_bits, approximate):
+    if bits <= max_bits:
+        return bits, True
+    if not approximate:
+        raise ValueError(f"{ast.unparse(node)} is too large to compute exactly (about {bits:.3g} bits, limit {max_bits})")
+    node.approximate = True
+    return float(FLOAT_BITS), False
+
+
+def approximate_pow(base, exponent):
+    """Floating-point base ** exponent, infinite where the exact result would be out of float range"""
+    try:
+        return float(base) ** float(exponent)
+    except OverflowError:
+        negative = base < 0 and exponent % 2 == 1
+        return -math.inf if negative else math.inf
+
+
+def approximate_operator(op):
+    """op computed on floats, for integer results too large to compute exactly"""
+    def apply(left, right):
+        return op(to_float(left), to_float(right))
+    return apply
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except OverflowError:
+        return math.inf if value > 0 else -math.inf
+
+
+def approximate_factorial(n):
+    """n! from the log-gamma function (Stirling's series), infinite out of float range"""
+    if n < 0:
+        raise ValueError("factorial() not defined for negative values")
+    try:
+        return math.exp(math.lgamma(n + 1))
+    except OverflowError:
+        return math.inf
+
+
+def compile_expression(node, operators, functions, constants, variables=(), literal=None):
+    """Compile a parsed expression into a closure taking a dict of variable values
+
+    Every name, call and operator is checked against the given whitelist
+    tables, so anything the closure does was allowed at compile time.
+    Nodes marked by check_expression_cost are computed approximately, and
+    numeric literals are passed through literal (e.g. Decimal) when given.
+    """
+    if isinstance(node, ast.Constant):
+        value = node.value
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f"Unsupported literal: {value!r}")
+        if literal is not None:
+            value = literal(value)
+        return lambda env: value
+
+    if isinstance(node, ast.Name):
+        name = node.id
+        if name in variables:
+            return lambda env: env[name]
+        if name in constants:
+            value = constants[name]
+            return lambda env: value
+        if name in functions:
+            raise ValueError(f"Function '{name}' must be called with arguments")
+        raise ValueError(f"Unknown name: {name}")
+
+    if isinstance(node, ast.BinOp):
+        first, steps = binary_chain(node)
+        left = compile_expression(first, operators, functions, constants, variables, literal)
+        ops = []
+        for step in steps:
+            symbol = BINARY_OPERATOR_SYMBOLS.get(type(step.op))
+            if symbol is None or symbol not in operators:
+                raise ValueError(f"Unsupported operator: {type(step.op).__name__}")
+            op = operators[symbol]
+            if getattr(step, 'approximate', False):
+                op = approximate_pow if symbol == '**' else approximate_operator(op)
+            ops.append((op, compile_expression(step.right, operators, functions, constants, variables, literal)))
+
+        if len(ops) == 1:
+            op, right = ops[0]
+            return lambda env: op(left(env), right(env))
+
+        def chain(env):
+            value = left(env)
+            for op, right in ops:
+                value = op(value, right(env))
+            return value
+        return chain
+
+    if isinstance(node, ast.UnaryOp):
+        op = UNARY_OPERATORS.get(type(node.op))
+        if op is None:
+            raise ValueError(f"Unsupported operator: {type(node.op).__name__}")
+        operand = compile_expression(node.operand, operators, functions, constants, variables, literal)
+        return lambda env: op(operand(env))
+
+    if isinstance(node, ast.Call):
+        if not isinstance(node.func, ast.Name) or node.func.id not in functions:
+            name = node.func.id if isinstance(node.func, ast.Name) else ast.unparse(node.func)
+            raise ValueError(f"Unknown function: {name}")
+        if node.keywords or any(isinstance(arg, ast.Starred) for arg in node.args):
+            raise ValueError(f"Invalid arguments for {node.func.id}()")
+        func = approximate_factorial if getattr(node, 'approximate', False) else functions[node.func.id]
+        args = [compile_expression(arg, operators, functions, constants, variables, literal) for arg in node.args]
+        if len(args) == 1:
+            arg = args[0]
+            return lambda env: func(arg(env))
+        return lambda env: func(*[arg(env) for arg in args])
+
+    raise ValueError(f"Unsupported expression: {type(node).__name__}")
+
+
+class CompiledExpression:
+    """Compiled expression with its result memoized once evaluated"""
+
+    _UNSET = object()
+
+    def __init__(self, func, constant=True):
+        self.func = func
+        self.constant = constant
+        self._value = self._UNSET
+
+    def __call__(self, env=None):
+        if not self.constant:
+            return self.func(env)
+        # Every whitelisted function is pure, so an expression without
+        # variables always evaluates to the same value
+        if self._value is self._UNSET:
+            self._value = self.func({})
+        return self._value
+
+
+class ExpressionCache:
+    """Bounded, thread-safe LRU cache of compiled expressions"""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key, entry):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,190 @@
+import atexit
+import logging
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+from .models import CalculationHistory
+
+logger = logging.getLogger(__name__)
+
+HISTORY_DURABILITY_MODES = ('sync', 'buffered')
+
+
+def history_durability():
+    durability = getattr(settings, 'KCALC_HISTORY_DURABILITY', 'sync')
+    if durability not in HISTORY_DURABILITY_MODES:
+        raise ValueError(f"KCALC_HISTORY_DURABILITY must be one of: {', '.join(HISTORY_DURABILITY_MODES)}")
+    return durability
+
+
+class HistoryWriter:
+    """In-process write-behind queue for CalculationHistory rows
+
+    Rows are written with bulk_create by a background thread once
+    KCALC_HISTORY_FLUSH_SIZE rows are queued or KCALC_HISTORY_FLUSH_INTERVAL
+    seconds have passed, and once more when the process exits. Rows still
+    queued when the process dies without a clean exit are lost.
+    """
+
+    def __init__(self):
+        self._pending = []
+        self._lock = threading.Lock()
+        # Serializes flushes so rows are written in the order they were queued
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.rows_written = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+
+    @property
+    def flush_size(self):
+        return getattr(settings, 'KCALC_HISTORY_FLUSH_SIZE', 100)
+
+    @property
+    def flush_interval(self):
+        return getattr(settings, 'KCALC_HISTORY_FLUSH_INTERVAL', 1.0)
+
+    @property
+    def max_pending(self):
+        return getattr(settings, 'KCALC_HISTORY_MAX_PENDING', 10000)
+
+    @property
+    def full(self):
+        return len(self._pending) >= self.max_pending
+
+    def add(self, records):
+        """Queue unsaved CalculationHistory instances"""
+        with self._lock:
+            self._pending.extend(records)
+            depth = len(self._pending)
+
+        self._start()
+        if depth >= self.flush_size:
+            self._wakeup.set()
+
+    def flush(self):
+        """Write every queued row, returning how many were written"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+
+            start = time.perf_counter()
+            try:
+                CalculationHistory.objects.bulk_create(batch, batch_size=self.flush_size)
+            except Exception:
+                # Put the rows back in front of anything queued since, to retry on the next flush
+                with self._lock:
+                    self._pending[:0] = batch
+                    self.failed_flushes += 1
+                raise
+
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.flushes += 1
+                self.rows_written += len(batch)
+                self.last_flush_seconds = elapsed
+                self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+                self.total_flush_seconds += elapsed
+            return len(batch)
+
+    def stop(self):
+        """Stop the background thread and write whatever is still queued"""
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=max(self.flush_interval, 1.0) * 5)
+            self._thread = None
+        self._stopping = False
+        if self._pending:
+            self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queue_depth': len(self._pending),
+                'flushes': self.flushes,
+                'failed_flushes': self.failed_flushes,
+                'rows_written': self.rows_written,
+                'last_flush_ms': self.last_flush_seconds * 1000,
+                'max_flush_ms': self.max_flush_seconds * 1000,
+                'mean_flush_ms': self.total_flush_seconds * 1000 / self.flushes if self.flushes else 0.0,
+            }
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='kcalc-history-writer', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopping:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            # This thread lives outside the request cycle, so recycle its connection the same way
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to write queued calculation history")
+            finally:
+                close_old_connections()
+
+
+writer = HistoryWriter()
+atexit.register(writer.stop)
+
+
+def record_history(records):
+    """Save new CalculationHistory instances according to KCALC_HISTORY_DURABILITY
+
+    'sync' inserts them before returning. 'buffered' hands them to the
+    write-behind queue, so their timestamps record when they were written,
+    at most a flush interval after the calculation.
+    """
+    if not records:
+        return
+    if history_durability() == 'buffered':
+        if writer.full:
+            # The flusher is falling behind (or the database is down): write
+            # from the request rather than queue without bound
+            writer.flush()
+        writer.add(records)
+    else:
+        CalculationHistory.objects.bulk_create(records)
+
+
+async def arecord_history(records):
+    """Async version of record_history"""
+    if not records:
+        return
+    if history_durability() == 'buffered':
+        if writer.full:
+            await sync_to_async(writer.flush)()
+        writer.add(records)
+    else:
+        await CalculationHistory.objects.abulk_create(records)
+
+
+def flush_history():
+    """Write out queued history so that reads and deletes see every calculation so far"""
+    if writer.stats()['queue_depth']:
+        writer.flush()
+
+
+async def aflush_history():
+    """Async version of flush_history"""
+    if writer.stats()['queue_depth']:
+        await sync_to_async(writer.flush)()
@@ -0,0 +1,299 @@
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+
+import django
+import numpy as np
+from django.conf import settings
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+# Expressions in roughly the mix the calculator sees
+EXPRESSIONS = [
+    '2+3*4',
+    '(17.5-3)/2.5',
+    'sqrt(2)*pi',
+    'sin(pi/6)+cos(pi/3)',
+    'log(1000)+ln(e**2)',
+    '2**10-factorial(6)',
+    'abs(-42.5)+round(3.14159)',
+    'exp(1.5)/tan(0.3)',
+]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(math.ceil(fraction * len(sorted_values)) - 1, 0)]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the calculator on a throwaway database: seed history, sessions and preferences, "
+        "time the hot functions, load test the API through the test client and write a JSON report"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help="Write the JSON report to this file instead of stdout")
+        parser.add_argument('--compare', help="Print the change of every metric against an earlier report")
+        parser.add_argument('--history-rows', type=int, default=10000, help="History rows to seed (default 10000)")
+        parser.add_argument('--sessions', type=int, default=100, help="Sessions to seed (default 100)")
+        parser.add_argument('--repeat', type=int, default=5, help="Timing runs per micro-benchmark (default 5)")
+        parser.add_argument('--concurrency', type=int, default=4, help="Client threads in the load test (default 4)")
+        parser.add_argument('--requests', type=int, default=400, help="Requests per endpoint in the load test (default 400)")
+        parser.add_argument('--skip-micro', action='store_true', help="Skip the micro-benchmarks")
+        parser.add_argument('--skip-load', action='store_true', help="Skip the load test")
+
+    def handle(self, *args, **options):
+        random.seed(0)
+        report = {
+            'meta': self.meta(),
+            'seed': {'history_rows': options['history_rows'], 'sessions': options['sessions']},
+        }
+
+        if not options['skip_micro']:
+            self.stderr.write("Running micro-benchmarks")
+            report['micro'] = self.micro_benchmarks(options['repeat'])
+
+        if not options['skip_load']:
+            report['load'] = self.with_test_database(self.load_test, options)
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stderr.write(f"Report written to {options['output']}")
+        else:
+            self.stdout.write(output)
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                self.compare(json.load(f), report)
+
+    def meta(self):
+        return {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'numpy': np.__version__,
+            'cpus': os.cpu_count(),
+            'database': connection.vendor,
+            'settings': {
+                name: getattr(settings, name, None)
+                for name in (
+                    'KCALC_EVALUATION_SANDBOX',
+                    'KCALC_HISTORY_DURABILITY',
+                    'KCALC_ASYNC_VIEWS',
+                    'KCALC_TIMING',
+                    'KCALC_EXPENSIVE_EXPRESSIONS',
+                )
+            },
+        }
+
+    def micro_benchmarks(self, repeat):
+        """Per-call times, in microseconds, of the functions on the request hot path"""
+        from kcalc.views import (
+            AdvancedCalculator,
+            evaluate_function,
+            format_result,
+            handle_graph_calculation,
+            handle_matrix_calculation,
+        )
+
+        calculator = AdvancedCalculator()
+        counter = iter(range(10 ** 9))
+        small = [[4, 3, 2], [2, 1, 3], [3, 2, 1]]
+        rng = np.random.default_rng(0)
+        medium = rng.standard_normal((100, 100)).tolist()
+        medium_array = np.asarray(medium)
+        stack = rng.standard_normal((1000, 3, 3)).tolist()
+
+        benchmarks = {
+            'evaluate.cached': lambda: calculator.evaluate('sin(pi/6)+cos(pi/3)'),
+            # A new expression every call, compiled from scratch
+            'evaluate.uncached': lambda: calculator.evaluate(f'{next(counter)}*3+sqrt(2)'),
+            'evaluate.decimal': lambda: calculator.evaluate('1/3', 30),
+            'evaluate_function': lambda: evaluate_function('sin(x)*x**2', 1.5),
+            'graph.plot': lambda: handle_graph_calculation('sin(x)*x', 'plot', {}),
+            'matrix.det.3x3': lambda: handle_matrix_calculation(small, 'det'),
+            'matrix.inv.3x3': lambda: handle_matrix_calculation(small, 'inv'),
+            'matrix.inv.100x100': lambda: handle_matrix_calculation(medium, 'inv'),
+            'matrix.eigenvalues.100x100': lambda: handle_matrix_calculation(medium, 'eigenvalues'),
+            'matrix.det.stack1000x3x3': lambda: handle_matrix_calculation(stack, 'det'),
+            'format_result.scalar': lambda: format_result(2 / 3, 10),
+            'format_result.matrix100x100': lambda: format_result(medium_array, 10, 'matrix'),
+        }
+
+        results = {}
+        for name, func in benchmarks.items():
+            timer = timeit.Timer(func)
+            number, _ = timer.autorange()
+            runs = [seconds / number * 1e6 for seconds in timer.repeat(repeat, number)]
+            results[name] = {
+                'best_us': min(runs),
+                'median_us': statistics.median(runs),
+                'number': number,
+            }
+            self.stderr.write(f"  {name}: {min(runs):.1f} us")
+        return results
+
+    def with_test_database(self, func, options):
+        """Run func(options) against a freshly created test database, destroyed afterwards"""
+        directory = None
+        if connection.vendor == 'sqlite':
+            # Load test threads need a database file rather than per-connection memory
+            directory = tempfile.mkdtemp(prefix='kcalc-benchmark-')
+            settings.DATABASES['default'].setdefault('TEST', {})['NAME'] = os.path.join(directory, 'benchmark.sqlite3')
+
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            return func(options)
+        finally:
+            from kcalc.history import flush_history
+            flush_history()
+            connections.close_all()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            if directory:
+                shutil.rmtree(directory, ignore_errors=True)
+
+    def seed(self, client_sessions, history_rows, sessions):
+        """History rows, sessions and preferences, spread over the load test clients and other sessions"""
+        from kcalc.models import CalculationHistory, UserPreferences
+        from kcalc.preferences import PREFERENCE_DEFAULTS
+
+        other_sessions = []
+        for _ in range(max(sessions - len(client_sessions), 0)):
+            store = SessionStore()
+            store.create()
+            other_sessions.append(store.session_key)
+        UserPreferences.objects.bulk_create(
+            UserPreferences(session_key=key, **PREFERENCE_DEFAULTS) for key in other_sessions
+        )
+
+        session_keys = client_sessions + other_sessions
+        CalculationHistory.objects.bulk_create(
+            (
+                CalculationHistory(
+                    session_key=random.choice(session_keys),
+                    expression=expression,
+                    result='0',
+                    calculation_type='scientific' if any(c.isalpha() for c in expression) else 'basic',
+                )
+                for expression in (random.choice(EXPRESSIONS) for _ in range(history_rows))
+            ),
+            batch_size=1000,
+        )
+
+    def load_test(self, options):
+        """Latency and throughput of the API endpoints with concurrent test clients"""
+        concurrency = options['concurrency']
+        clients = [Client() for _ in range(concurrency)]
+        for client in clients:
+            # Creates the session and preferences, and starts the evaluation sandbox
+            client.post('/api/calculate/', json.dumps({'expression': '1+1'}), content_type='application/json')
+        self.stderr.write(f"Seeding {options['history_rows']} history rows")
+        self.seed([client.session.session_key for client in clients], options['history_rows'], options['sessions'])
+        connections.close_all()
+
+        def calculate(client, i):
+            return client.post(
+                '/api/calculate/', json.dumps({'expression': EXPRESSIONS[i % len(EXPRESSIONS)]}),
+                content_type='application/json'
+            )
+
+        def history(client, i):
+            return client.get('/api/history/', {'page': i % 5 + 1, 'per_page': 20})
+
+        def memory(client, i):
+            return client.post('/api/memory/', json.dumps({'action': 'add', 'value': 1}), content_type='application/json')
+
+        results = {}
+        for name, request in (('calculate_api', calculate), ('history_api', history), ('memory_api', memory)):
+            self.stderr.write(f"Load testing {name}")
+            results[name] = self.run_load(clients, request, options['requests'])
+        return results
+
+    def run_load(self, clients, request, total):
+        latencies = []
+        errors = 0
+        lock = threading.Lock()
+
+        def worker(index):
+            nonlocal errors
+            client = clients[index]
+            timings = []
+            failed = 0
+            try:
+                for i in range(index, total, len(clients)):
+                    start = time.perf_counter()
+                    try:
+                        response = request(client, i)
+                        failed += response.status_code >= 400
+                    except Exception:
+                        failed += 1
+                    timings.append(time.perf_counter() - start)
+            finally:
+                connection.close()
+            with lock:
+                latencies.extend(timings)
+                errors += failed
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(clients)) as executor:
+            list(executor.map(worker, range(len(clients))))
+        elapsed = time.perf_counter() - start
+
+        latencies.sort()
+        return {
+            'requests': total,
+            'errors': errors,
+            'concurrency': len(clients),
+            'throughput_rps': total / elapsed,
+            'mean_ms': statistics.fmean(latencies) * 1000 if latencies else 0.0,
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'max_ms': latencies[-1] * 1000 if latencies else 0.0,
+        }
+
+    def compare(self, baseline, report):
+        """Print each numeric metric of report next to its baseline value"""
+        def metrics(data, prefix=''):
+            for key, value in data.items():
+                if isinstance(value, dict):
+                    yield from metrics(value, f'{prefix}{key}.')
+                elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                    yield f'{prefix}{key}', value
+
+        before = dict(metrics({key: baseline.get(key, {}) for key in ('micro', 'load')}))
+        for name, value in metrics({key: report.get(key, {}) for key in ('micro', 'load')}):
+            if name.endswith(('.number', '.requests', '.concurrency')) or name not in before:
+                continue
+            old = before[name]
+            change = f'{(value - old) / old * 100:+.1f}%' if old else 'n/a'
+            self.stderr.write(f"{name}: {old:.2f} -> {value:.2f} ({change})")
@@ -0,0 +1,393 @@
+import base64
+import io
+import math
+
+import numpy as np
+
+try:
+    import scipy.linalg
+except ImportError:  # lu falls back to a NumPy implementation
+    scipy = None
+
+# Binary matrix formats accepted in matrix_data and as response_format:
+# 'base64' is raw little-endian float64 in row-major order plus a shape,
+# 'npy' is a whole NumPy .npy file
+MATRIX_ENCODINGS = ('base64', 'npy')
+
+
+def parse_matrix(matrix_data, stack=False):
+    """Convert request matrix_data into a 2-D float array
+
+    matrix_data is either a list of rows, where empty and non-numeric cells
+    count as 0, or a binary matrix dict (see decode_matrix). With stack=True
+    a list of same-shaped matrices, or a binary array with a 3-D shape, is
+    also accepted and returned as a (count, rows, cols) array.
+    """
+    dimensions = (2, 3) if stack else (2,)
+
+    if isinstance(matrix_data, dict):
+        matrix = decode_matrix(matrix_data)
+    else:
+        cells = np.asarray(matrix_data, dtype=object)
+        if cells.size == 0:
+            return np.zeros((0, 0))
+        if cells.ndim not in dimensions:
+            raise ValueError("Matrix must be a list of rows of equal length")
+
+        # Masked coercion: blank cells become 0, everything else converts in one pass
+        cells[np.equal(cells, None) | np.equal(cells, '')] = 0
+        try:
+            return cells.astype(float)
+        except (ValueError, TypeError):
+            pass
+        # Only inputs with non-numeric text, or ragged nesting, get here
+        if any(isinstance(cell, list) for cell in cells.flat):
+            raise ValueError("Matrix must be a list of rows of equal length")
+        return np.vectorize(to_float, otypes=[float])(cells)
+
+    if matrix.ndim not in dimensions:
+        raise ValueError("Matrix must be 2-dimensional")
+    return matrix
+
+
+def parse_vector(vector_data):
+    """Convert the right-hand side of a solve request into a float vector or matrix"""
+    if isinstance(vector_data, list) and not any(isinstance(cell, list) for cell in vector_data):
+        return parse_matrix([vector_data])[0]
+    return parse_matrix(vector_data)
+
+
+def to_float(cell):
+    try:
+        return float(cell)
+    except (ValueError, TypeError):
+        return 0.0
+
+
+def decode_matrix(matrix_data):
+    """Decode {'encoding': 'base64', 'shape': [rows, cols], 'data': ...} or {'encoding': 'npy', 'data': ...}
+
+    A stack of matrices has shape [count, rows, cols].
+    """
+    encoding = matrix_data.get('encoding')
+    if encoding not in MATRIX_ENCODINGS:
+        raise ValueError(f"Matrix encoding must be one of: {', '.join(MATRIX_ENCODINGS)}")
+
+    try:
+        raw = base64.b64decode(matrix_data.get('data', ''), validate=True)
+    except ValueError:
+        raise ValueError("Matrix data is not valid base64")
+
+    if encoding == 'npy':
+        try:
+            matrix = np.load(io.BytesIO(raw), allow_pickle=False)
+        except (ValueError, OSError):
+            raise ValueError("Matrix data is not a valid .npy file")
+        if matrix.dtype.kind not in 'biuf':
+            raise ValueError("Matrix must hold real numbers")
+        matrix = matrix.astype(float, copy=False)
+    else:
+        shape = matrix_data.get('shape')
+        if not isinstance(shape, list) or len(shape) not in (2, 3) or not all(isinstance(n, int) and n >= 0 for n in shape):
+            raise ValueError("Matrix shape must be [rows, columns]")
+        if len(raw) != math.prod(shape) * 8:
+            raise ValueError("Matrix data does not match its shape")
+        matrix = np.frombuffer(raw, dtype='<f8').reshape(shape)
+
+    return matrix
+
+
+def encode_matrix(matrix, encoding):
+    """Encode a float array in one of MATRIX_ENCODINGS, the inverse of decode_matrix"""
+    matrix = np.ascontiguousarray(matrix, dtype='<f8')
+    if encoding == 'npy':
+        buffer = io.BytesIO()
+        np.save(buffer, matrix, allow_pickle=False)
+        return {'encoding': 'npy', 'data': base64.b64encode(buffer.getvalue()).decode()}
+    return {
+        'encoding': 'base64',
+        'dtype': 'float64',
+        'shape': list(matrix.shape),
+        'data': base64.b64encode(matrix.tobytes()).decode(),
+    }
+
+
+def format_cells(matrix, decimal_places):
+    """Format every cell of a real 1-D or 2-D array the way format_result formats a number"""
+    # Adding 0.0 turns -0.0 into 0.0
+    values = np.asarray(matrix, dtype=float) + 0.0
+    fmt = f'%.{decimal_places}f'.__mod__
+
+    if decimal_places > 0:
+        def format_row(row):
+            return [fmt(value).rstrip('0').rstrip('.') for value in row]
+    else:
+        def format_row(row):
+            return list(map(fmt, row))
+
+    if values.ndim == 1:
+        return format_row(values.tolist())
+    return [format_row(row) for row in values.tolist()]
+
+
+def encode_result(result, encoding):
+    """encode_matrix every array in a matrix result, including the values of a decomposition dict"""
+    if isinstance(result, np.ndarray):
+        if np.iscomplexobj(result):
+            raise ValueError("Complex results cannot be encoded as float64, use response_format json")
+        return encode_matrix(result, encoding)
+    if isinstance(result, dict):
+        return {key: encode_result(value, encoding) for key, value in result.items()}
+    return result
+
+
+def describe_encoded(result):
+    """Short text for an encoded matrix result, e.g. for the history"""
+    if 'encoding' in result:
+        shape = result.get('shape')
+        if not shape:
+            return "Binary matrix"
+        return f"{shape[0]}-element vector" if len(shape) == 1 else f"{shape[0]}x{shape[1]} matrix"
+    return ', '.join(
+        f"{key}: {describe_encoded(value) if isinstance(value, dict) else value}"
+        for key, value in result.items()
+    )
+
+
+def count_cells(result):
+    """Number of cells in a JSON matrix result: nested lists, or a dict of them"""
+    if isinstance(result, dict):
+        return sum(count_cells(value) for value in result.values())
+    if isinstance(result, list):
+        if result and isinstance(result[0], list):
+            return sum(count_cells(row) for row in result)
+        return len(result)
+    return 1
+
+
+def describe_cells(result):
+    """Short text for a JSON matrix result, like describe_encoded"""
+    if isinstance(result, dict):
+        return ', '.join(f"{key}: {describe_cells(value)}" for key, value in result.items())
+    if isinstance(result, list):
+        if result and isinstance(result[0], list):
+            return f"{len(result)}x{len(result[0])} matrix"
+        return f"{len(result)}-element vector"
+    return str(result)
+
+
+def eigen_result(values, vectors=None):
+    """Eigenvalues, and optionally eigenvectors as columns, split into real and imaginary parts"""
+    result = {'real': values.real, 'imag': values.imag}
+    if vectors is not None:
+        result['vectors'] = {'real': vectors.real, 'imag': vectors.imag}
+    return result
+
+
+def eigenvalues(matrix, vectors=False):
+    if vectors:
+        return eigen_result(*np.linalg.eig(matrix))
+    return eigen_result(np.linalg.eigvals(matrix))
+
+
+def round_cells(values, decimal_places):
+    """values rounded to decimal_places in one vectorized step, as nested lists of numbers"""
+    # Adding 0.0 turns -0.0 into 0.0
+    return (np.round(values, decimal_places) + 0.0).tolist()
+
+
+def format_eigen(result, decimal_places):
+    """Format an eigen_result for JSON without per-element Python work"""
+    formatted = {
+        'real': round_cells(result['real'], decimal_places),
+        'imag': round_cells(result['imag'], decimal_places),
+    }
+    if 'vectors' in result:
+        formatted['vectors'] = format_eigen(result['vectors'], decimal_places)
+    return formatted
+
+
+def require_square(matrix, operation):
+    if matrix.shape[0] != matrix.shape[1]:
+        raise ValueError(f"Matrix must be square for {operation}")
+
+
+NON_FINITE_DETERMINANT = "Matrix must contain only finite numbers for determinant calculation"
+
+
+def determinant(matrix):
+    """Determinant from the log-determinant, so it does not overflow for large matrices
+
+    Determinants beyond the float range are returned as scientific notation
+    text, to the 10 significant digits that survive summing the logarithms.
+    """
+    if not np.isfinite(matrix).all():
+        # e.g. 1e400 parsed as inf, which slogdet turns into NaN
+        raise ValueError(NON_FINITE_DETERMINANT)
+    sign, logdet = np.linalg.slogdet(matrix)
+    if logdet < math.log(np.finfo(float).max):
+        return float(sign * math.exp(logdet))
+    exponent, mantissa = divmod(logdet / math.log(10), 1)
+    mantissa = round(10 ** mantissa, 9)
+    if mantissa >= 10:
+        exponent, mantissa = exponent + 1, mantissa / 10
+    return f"{sign * mantissa:.10g}e+{int(exponent)}"
+
+
+def check_conditioning(matrix, inverse):
+    """Raise ValueError if inverse is too inaccurate to use
+
+    The 1-norm condition number is computed exactly from the inverse, at
+    O(n^2) on top of the factorization that produced it.
+    """
+    condition = np.linalg.norm(matrix, 1) * np.linalg.norm(inverse, 1)
+    if not np.isfinite(condition) or condition * np.finfo(float).eps >= 1:
+        raise ValueError("Matrix is singular (non-invertible)")
+
+
+def inverse(matrix):
+    """Inverse from a single LU factorization, rejecting singular and numerically singular matrices"""
+    try:
+        result = np.linalg.inv(matrix)
+    except np.linalg.LinAlgError:
+        raise ValueError("Matrix is singular (non-invertible)")
+    check_conditioning(matrix, result)
+    return result
+
+
+def solve(matrix, rhs):
+    """Solve matrix @ x = rhs without forming the inverse"""
+    if rhs.shape[0] != matrix.shape[0]:
+        raise ValueError(f"Right-hand side must have {matrix.shape[0]} rows")
+    try:
+        result = np.linalg.solve(matrix, rhs)
+    except np.linalg.LinAlgError:
+        raise ValueError("Matrix is singular, the system has no unique solution")
+    if not np.all(np.isfinite(result)):
+        raise ValueError("Matrix is singular, the system has no unique solution")
+    return result
+
+
+def lu(matrix):
+    """LU factorization with partial pivoting, matrix = P @ L @ U"""
+    if scipy is not None:
+        p, l, u = scipy.linalg.lu(matrix)
+        return {'P': p, 'L': l, 'U': u}
+
+    n = matrix.shape[0]
+    u = matrix.copy()
+    l = np.eye(n)
+    rows = np.arange(n)
+    for k in range(n - 1):
+        pivot = k + int(np.argmax(np.abs(u[k:, k])))
+        if pivot != k:
+            u[[k, pivot], k:] = u[[pivot, k], k:]
+            l[[k, pivot], :k] = l[[pivot, k], :k]
+            rows[[k, pivot]] = rows[[pivot, k]]
+        if u[k, k] != 0:
+            l[k + 1:, k] = u[k + 1:, k] / u[k, k]
+            u[k + 1:, k:] -= np.outer(l[k + 1:, k], u[k, k:])
+    # Row i of L @ U is row rows[i] of matrix
+    return {'P': np.eye(n)[rows].T, 'L': l, 'U': np.triu(u)}
+
+
+def qr(matrix):
+    q, r = np.linalg.qr(matrix)
+    return {'Q': q, 'R': r}
+
+
+def svd(matrix):
+    u, s, vt = np.linalg.svd(matrix)
+    return {'U': u, 'S': s, 'Vt': vt}
+
+
+def eigh(matrix):
+    """Eigenvalues, in ascending order, and eigenvectors of a symmetric matrix"""
+    if not np.allclose(matrix, matrix.T):
+        raise ValueError("Matrix must be symmetric for eigh, use eigenvalues instead")
+    return eigen_result(*np.linalg.eigh(matrix))
+
+
+# Actions that run over a whole stack of matrices in batched NumPy calls
+STACK_ACTIONS = ('det', 'inv', 'trace', 'eigenvalues', 'rank', 'transpose')
+
+
+def stack_calculation(stack, action, options=None):
+    """Run action over every matrix of a (count, rows, cols) stack at once
+
+    Returns {'results': array with one entry per matrix, 'errors': list}, where
+    errors holds a message for each matrix that failed and None for the rest.
+    The results of failed matrices are NaN. Eigenvalue results are an
+    eigen_result of such arrays.
+    """
+    if action not in STACK_ACTIONS:
+        raise ValueError(f"Matrix stacks support only: {', '.join(STACK_ACTIONS)}")
+    if action in ('det', 'inv', 'trace', 'eigenvalues'):
+        require_square(stack[0], f"{action} calculation")
+
+    errors = [None] * len(stack)
+    if action == 'det':
+        finite = np.isfinite(stack).all(axis=(1, 2))
+        sign, logdet = np.linalg.slogdet(stack)
+        with np.errstate(over='ignore'):
+            results = sign * np.exp(logdet)
+        for i in np.flatnonzero(~finite):
+            errors[i] = NON_FINITE_DETERMINANT
+            results[i] = np.nan
+        for i in np.flatnonzero(np.isinf(results) & finite):
+            errors[i] = f"Determinant {determinant(stack[i])} is beyond the float range"
+            results[i] = np.nan
+    elif action == 'inv':
+        results = stack_inverse(stack)
+        condition = one_norms(stack) * one_norms(results)
+        # NaN conditions, from matrices that failed to invert, compare False
+        for i in np.flatnonzero(~(condition * np.finfo(float).eps < 1)):
+            errors[i] = "Matrix is singular (non-invertible)"
+            results[i] = np.nan
+    elif action == 'trace':
+        results = np.trace(stack, axis1=1, axis2=2)
+    elif action == 'eigenvalues':
+        results = eigenvalues(stack, (options or {}).get('eigenvectors', False))
+    elif action == 'rank':
+        results = np.linalg.matrix_rank(stack)
+    else:
+        results = stack.transpose(0, 2, 1)
+
+    return {'results': results, 'errors': errors}
+
+
+def stack_inverse(stack):
+    try:
+        return np.linalg.inv(stack)
+    except np.linalg.LinAlgError:
+        # One exactly singular matrix fails the whole batch, so invert one by one
+        results = np.full(stack.shape, np.nan)
+        for i, matrix in enumerate(stack):
+            try:
+                results[i] = np.linalg.inv(matrix)
+            except np.linalg.LinAlgError:
+                pass
+        return results
+
+
+def one_norms(stack):
+    """Matrix 1-norm (largest absolute column sum) of every matrix in a stack"""
+    return np.abs(stack).sum(axis=1).max(axis=1)
+
+
+def format_stack(result, decimal_places):
+    """Format the results of stack_calculation, with None for the matrices that failed"""
+    results = result['results']
+    if isinstance(results, dict):
+        # Eigenvalues, which never fail for a single matrix
+        return {'results': format_eigen(results, decimal_places), 'errors': result['errors']}
+    if results.ndim == 1:
+        formatted = format_cells(results, decimal_places)
+    else:
+        formatted = [format_cells(matrix, decimal_places) for matrix in results]
+
+    errors = result['errors']
+    for i, error in enumerate(errors):
+        if error is not None:
+            formatted[i] = None
+    return {'results': formatted, 'errors': errors}
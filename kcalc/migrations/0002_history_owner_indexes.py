@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:21
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("kcalc", "0001_initial"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="calculationhistory",
+            index=models.Index(
+                fields=["user", "-timestamp"], name="kcalc_history_user_ts_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="calculationhistory",
+            index=models.Index(
+                fields=["session_key", "-timestamp"],
+                name="kcalc_history_session_ts_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="userpreferences",
+            index=models.Index(fields=["session_key"], name="kcalc_prefs_session_idx"),
+        ),
+    ]
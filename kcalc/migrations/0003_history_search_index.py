@@ -0,0 +1,107 @@
+from django.db import migrations
+
+# Rows are indexed by owner too ("u<user id>" or "s<session key>"), so a search
+# only ever touches the requesting user's documents. The table is contentless:
+# CalculationHistory already stores the text.
+OWNER = "CASE WHEN {row}.user_id IS NOT NULL THEN 'u' || {row}.user_id ELSE 's' || {row}.session_key END"
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE kcalc_history_fts USING fts5(
+        expression, result, owner,
+        content='', tokenize="unicode61 tokenchars '.'"
+    )
+    """,
+    f"""
+    CREATE TRIGGER kcalc_history_fts_insert AFTER INSERT ON kcalc_calculationhistory BEGIN
+        INSERT INTO kcalc_history_fts(rowid, expression, result, owner)
+        VALUES (new.id, new.expression, new.result, {OWNER.format(row="new")});
+    END
+    """,
+    f"""
+    CREATE TRIGGER kcalc_history_fts_delete AFTER DELETE ON kcalc_calculationhistory BEGIN
+        INSERT INTO kcalc_history_fts(kcalc_history_fts, rowid, expression, result, owner)
+        VALUES ('delete', old.id, old.expression, old.result, {OWNER.format(row="old")});
+    END
+    """,
+    f"""
+    CREATE TRIGGER kcalc_history_fts_update AFTER UPDATE ON kcalc_calculationhistory BEGIN
+        INSERT INTO kcalc_history_fts(kcalc_history_fts, rowid, expression, result, owner)
+        VALUES ('delete', old.id, old.expression, old.result, {OWNER.format(row="old")});
+        INSERT INTO kcalc_history_fts(rowid, expression, result, owner)
+        VALUES (new.id, new.expression, new.result, {OWNER.format(row="new")});
+    END
+    """,
+    f"""
+    INSERT INTO kcalc_history_fts(rowid, expression, result, owner)
+    SELECT id, expression, result, {OWNER.format(row="kcalc_calculationhistory")}
+    FROM kcalc_calculationhistory
+    """,
+]
+
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS kcalc_history_fts_insert",
+    "DROP TRIGGER IF EXISTS kcalc_history_fts_delete",
+    "DROP TRIGGER IF EXISTS kcalc_history_fts_update",
+    "DROP TABLE IF EXISTS kcalc_history_fts",
+]
+
+POSTGRES_FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """
+    CREATE INDEX kcalc_history_search_idx ON kcalc_calculationhistory
+    USING GIN (to_tsvector('simple', expression || ' ' || result))
+    """,
+    """
+    CREATE INDEX kcalc_history_expression_trgm_idx ON kcalc_calculationhistory
+    USING GIN (expression gin_trgm_ops)
+    """,
+    """
+    CREATE INDEX kcalc_history_result_trgm_idx ON kcalc_calculationhistory
+    USING GIN (result gin_trgm_ops)
+    """,
+]
+
+POSTGRES_REVERSE = [
+    "DROP INDEX IF EXISTS kcalc_history_search_idx",
+    "DROP INDEX IF EXISTS kcalc_history_expression_trgm_idx",
+    "DROP INDEX IF EXISTS kcalc_history_result_trgm_idx",
+]
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "sqlite" and sqlite_has_fts5(schema_editor):
+        statements = SQLITE_FORWARD
+    elif vendor == "postgresql":
+        statements = POSTGRES_FORWARD
+    else:
+        # history_api falls back to icontains without a search index
+        return
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    statements = {"sqlite": SQLITE_REVERSE, "postgresql": POSTGRES_REVERSE}
+    for statement in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def sqlite_has_fts5(schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("PRAGMA compile_options")
+        return any(option == "ENABLE_FTS5" for option, in cursor.fetchall())
+
+
+class Migration(migrations.Migration):
+    # The triggers live on the table itself, so any later migration that makes
+    # SQLite rebuild kcalc_calculationhistory has to recreate them.
+
+    dependencies = [
+        ("kcalc", "0002_history_owner_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -19,6 +19,11 @@ class CalculationHistory(models.Model):
 
     class Meta:
         ordering = ['-timestamp']
+        # History is always read per owner, newest first
+        indexes = [
+            models.Index(fields=['user', '-timestamp'], name='kcalc_history_user_ts_idx'),
+            models.Index(fields=['session_key', '-timestamp'], name='kcalc_history_session_ts_idx'),
+        ]
 
     def __str__(self):
         return f"{self.expression} = {self.result}"
@@ -34,3 +39,6 @@ class UserPreferences(models.Model):
 
     class Meta:
         unique_together = ['user', 'session_key']
+        indexes = [
+            models.Index(fields=['session_key'], name='kcalc_prefs_session_idx'),
+        ]
@@ -0,0 +1,241 @@
+import math
+import operator
+from decimal import ROUND_CEILING, ROUND_FLOOR, Decimal, localcontext
+from functools import lru_cache
+
+# Significant decimal digits a double always represents faithfully
+FLOAT_DIGITS = 15
+# Extra working digits absorbing rounding in intermediate steps
+GUARD_DIGITS = 10
+
+LOG10_2 = math.log10(2)
+
+
+def integer_digits(value):
+    """Number of digits before the decimal point of a float or int, at least 1"""
+    if isinstance(value, int):
+        return max(int(abs(value).bit_length() * LOG10_2) + 1, 1)
+    value = abs(value)
+    return int(math.log10(value)) + 1 if value >= 1 else 1
+
+
+def working_precision(result, decimal_places):
+    """Decimal digits needed to show result with decimal_places, or None when a float suffices
+
+    Results below 1 count as one integer digit, so that cancellation noise
+    such as sin(pi) = 1.2e-16 is not shown as significant digits.
+    """
+    if isinstance(result, float) and not math.isfinite(result):
+        return None
+    digits = integer_digits(result) + decimal_places
+    if digits <= FLOAT_DIGITS:
+        return None
+    return digits + GUARD_DIGITS
+
+
+def decimal_literal(value):
+    # repr gives the shortest string that round-trips, i.e. the literal as typed
+    return Decimal(value) if isinstance(value, int) else Decimal(repr(value))
+
+
+@lru_cache(maxsize=32)
+def _pi(prec):
+    with localcontext() as ctx:
+        ctx.prec = prec + 2
+        three = Decimal(3)
+        lasts, t, s, n, na, d, da = 0, three, 3, 1, 0, 0, 24
+        while s != lasts:
+            lasts = s
+            n, na = n + na, na + 8
+            d, da = d + da, da + 32
+            t = (t * n) / d
+            s += t
+    with localcontext() as ctx:
+        ctx.prec = prec
+        return +s
+
+
+def pi():
+    """pi at the current context precision"""
+    with localcontext() as ctx:
+        return _pi(ctx.prec)
+
+
+def decimal_constants():
+    """Values of AdvancedCalculator.CONSTANTS at the current context precision"""
+    return {'pi': pi(), 'e': Decimal(1).exp(), 'tau': 2 * pi()}
+
+
+def reduce_angle(x):
+    """x reduced into [-pi, pi), using enough digits of pi to keep the current precision"""
+    with localcontext() as ctx:
+        ctx.prec += max(x.adjusted(), 0) + 2
+        tau = 2 * pi()
+        x = x - tau * ((x + tau / 2) / tau).to_integral_value(rounding=ROUND_FLOOR)
+    return +x
+
+
+def sin(x):
+    x = reduce_angle(x)
+    with localcontext() as ctx:
+        ctx.prec += 2
+        i, lasts, s, fact, num, sign = 1, 0, x, 1, x, 1
+        while s != lasts:
+            lasts = s
+            i += 2
+            fact *= i * (i - 1)
+            num *= x * x
+            sign *= -1
+            s += num / fact * sign
+    return +s
+
+
+def cos(x):
+    x = reduce_angle(x)
+    with localcontext() as ctx:
+        ctx.prec += 2
+        i, lasts, s, fact, num, sign = 0, 0, 1, 1, 1, 1
+        while s != lasts:
+            lasts = s
+            i += 2
+            fact *= i * (i - 1)
+            num *= x * x
+            sign *= -1
+            s += num / fact * sign
+    return +s
+
+
+def tan(x):
+    return sin(x) / cos(x)
+
+
+def atan(x):
+    if x < 0:
+        return -atan(-x)
+    with localcontext() as ctx:
+        ctx.prec += 4
+        if x > 1:
+            return +(pi() / 2 - atan(1 / x))
+        # atan(x) = 2 atan(x / (1 + sqrt(1 + x^2))) until the series converges quickly
+        doublings = 0
+        while x > Decimal('0.1'):
+            x = x / (1 + (1 + x * x).sqrt())
+            doublings += 1
+        i, lasts, s, num, sign = 1, 0, x, x, 1
+        while s != lasts:
+            lasts = s
+            i += 2
+            num *= x * x
+            sign *= -1
+            s += num / i * sign
+        s *= 2 ** doublings
+    return +s
+
+
+def asin(x):
+    if abs(x) > 1:
+        raise ValueError("math domain error")
+    if abs(x) == 1:
+        return pi() / 2 * x
+    with localcontext() as ctx:
+        ctx.prec += 2
+        s = atan(x / (1 - x * x).sqrt())
+    return +s
+
+
+def acos(x):
+    with localcontext() as ctx:
+        ctx.prec += 2
+        s = pi() / 2 - asin(x)
+    return +s
+
+
+def sinh(x):
+    with localcontext() as ctx:
+        ctx.prec += 2
+        s = (x.exp() - (-x).exp()) / 2
+    return +s
+
+
+def cosh(x):
+    with localcontext() as ctx:
+        ctx.prec += 2
+        s = (x.exp() + (-x).exp()) / 2
+    return +s
+
+
+def tanh(x):
+    with localcontext() as ctx:
+        ctx.prec += 2
+        s = 1 - 2 / ((2 * x).exp() + 1)
+    return +s
+
+
+def degrees(x):
+    return x * 180 / pi()
+
+
+def radians(x):
+    return x * pi() / 180
+
+
+def factorial(x):
+    if x != x.to_integral_value():
+        raise ValueError("factorial() only accepts integral values")
+    return +Decimal(math.factorial(int(x)))
+
+
+def floordiv(a, b):
+    # Decimal // truncates towards zero, Python floors
+    return (a / b).to_integral_value(rounding=ROUND_FLOOR)
+
+
+def mod(a, b):
+    return a - b * floordiv(a, b)
+
+
+DECIMAL_OPERATORS = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.truediv,
+    '//': floordiv,
+    '%': mod,
+    '**': operator.pow,
+}
+
+# Decimal counterparts of AdvancedCalculator.FUNCTIONS
+DECIMAL_FUNCTIONS = {
+    'sin': sin,
+    'cos': cos,
+    'tan': tan,
+    'asin': asin,
+    'acos': acos,
+    'atan': atan,
+    'sinh': sinh,
+    'cosh': cosh,
+    'tanh': tanh,
+    'log': lambda x: x.log10(),
+    'ln': lambda x: x.ln(),
+    'sqrt': lambda x: x.sqrt(),
+    'exp': lambda x: x.exp(),
+    'abs': abs,
+    'ceil': lambda x: x.to_integral_value(rounding=ROUND_CEILING),
+    'floor': lambda x: x.to_integral_value(rounding=ROUND_FLOOR),
+    'round': round,
+    'factorial': factorial,
+    'degrees': degrees,
+    'radians': radians,
+    'min': min,
+    'max': max,
+}
+
+DECIMAL_DEGREE_FUNCTIONS = {
+    **DECIMAL_FUNCTIONS,
+    'sin': lambda x: sin(radians(x)),
+    'cos': lambda x: cos(radians(x)),
+    'tan': lambda x: tan(radians(x)),
+    'asin': lambda x: degrees(asin(x)),
+    'acos': lambda x: degrees(acos(x)),
+    'atan': lambda x: degrees(atan(x)),
+}
@@ -0,0 +1,115 @@
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import UserPreferences
+
+PREFERENCE_DEFAULTS = {
+    'theme': 'dark',
+    'decimal_places': 10,
+    'angle_unit': 'rad',
+    'memory_value': 0,
+}
+
+
+class CacheStats:
+    """Hit/miss counters for the preferences cache in this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def as_dict(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+
+stats = CacheStats()
+
+
+def preferences_cache():
+    return caches[getattr(settings, 'KCALC_PREFERENCES_CACHE', 'default')]
+
+
+def preferences_cache_key(user_id, session_key):
+    return f'kcalc:prefs:u{user_id}' if user_id else f'kcalc:prefs:s{session_key}'
+
+
+def get_preferences(user, session_key):
+    """Read-only preferences for a user or session, served from the cache when possible
+
+    Callers that modify and save preferences should load them from the
+    database instead and then call cache_preferences.
+    """
+    key = preferences_cache_key(user.pk if user else None, session_key)
+    prefs = preferences_cache().get(key)
+    stats.record(prefs is not None)
+
+    if prefs is None:
+        prefs, _ = UserPreferences.objects.get_or_create(
+            user=user,
+            session_key=session_key,
+            defaults=PREFERENCE_DEFAULTS
+        )
+        cache_preferences(prefs)
+
+    return prefs
+
+
+async def aget_preferences(user, session_key):
+    """Async version of get_preferences"""
+    key = preferences_cache_key(user.pk if user else None, session_key)
+    prefs = await preferences_cache().aget(key)
+    stats.record(prefs is not None)
+
+    if prefs is None:
+        prefs, _ = await UserPreferences.objects.aget_or_create(
+            user=user,
+            session_key=session_key,
+            defaults=PREFERENCE_DEFAULTS
+        )
+        await acache_preferences(prefs)
+
+    return prefs
+
+
+def cache_preferences(prefs):
+    """Write saved preferences through to the cache"""
+    preferences_cache().set(
+        preferences_cache_key(prefs.user_id, prefs.session_key),
+        prefs,
+        getattr(settings, 'KCALC_PREFERENCES_CACHE_TIMEOUT', 300)
+    )
+
+
+async def acache_preferences(prefs):
+    """Async version of cache_preferences"""
+    await preferences_cache().aset(
+        preferences_cache_key(prefs.user_id, prefs.session_key),
+        prefs,
+        getattr(settings, 'KCALC_PREFERENCES_CACHE_TIMEOUT', 300)
+    )
+
+
+def invalidate_preferences(user, session_key):
+    """Drop cached preferences, e.g. when the cached row no longer exists"""
+    preferences_cache().delete(preferences_cache_key(user.pk if user else None, session_key))
+
+
+async def ainvalidate_preferences(user, session_key):
+    """Async version of invalidate_preferences"""
+    await preferences_cache().adelete(preferences_cache_key(user.pk if user else None, session_key))
@@ -0,0 +1,116 @@
+import numpy as np
+
+
+def uniform_sample(func, x_min, x_max, num_points):
+    """Sample func on num_points + 1 evenly spaced x values"""
+    x_values = np.linspace(x_min, x_max, num_points + 1)
+    y_values, invalid = func(x_values)
+    return x_values, y_values, invalid
+
+
+def adaptive_sample(func, x_min, x_max, num_points, tolerance=1e-3, max_rounds=12):
+    """Sample func with at most num_points + 1 x values, refining where the curve bends or breaks
+
+    func takes an x array and returns (y, invalid) like views.sample_function,
+    either 1-D or stacked one row per function over the shared grid. A
+    coarse uniform grid is refined by bisecting the intervals whose endpoints
+    deviate most from a straight line, jump sharply, or switch between
+    plottable and unplottable (asymptotes and domain edges).
+    """
+    budget = num_points + 1
+    x_values, y_values, invalid = uniform_sample(func, x_min, x_max, max(min(budget // 4, budget - 1), 2))
+    # Stop bisecting below this width, otherwise true asymptotes swallow the budget
+    min_width = (x_max - x_min) / (budget * 64)
+
+    for _ in range(max_rounds):
+        remaining = budget - len(x_values)
+        if remaining <= 0:
+            break
+
+        scores = interval_scores(y_values, invalid)
+        scores[np.diff(x_values) <= min_width] = 0
+        candidates = np.flatnonzero(scores > tolerance)
+        if candidates.size == 0:
+            break
+        if candidates.size > remaining:
+            candidates = candidates[np.argsort(scores[candidates])[-remaining:]]
+            candidates.sort()
+
+        new_x = (x_values[candidates] + x_values[candidates + 1]) / 2
+        new_y, new_invalid = func(new_x)
+
+        # Midpoints land right after their interval's left endpoint, keeping x sorted
+        x_values = np.insert(x_values, candidates + 1, new_x)
+        y_values = np.insert(y_values, candidates + 1, new_y, axis=-1)
+        invalid = np.insert(invalid, candidates + 1, new_invalid, axis=-1)
+
+    return x_values, y_values, invalid
+
+
+def interval_scores(y_values, invalid, jump_limit=0.25):
+    """Score each interval between consecutive samples by how much it needs refining"""
+    if y_values.ndim > 1:
+        # A shared grid needs refining wherever any of its functions does
+        return np.max([interval_scores(y, mask, jump_limit) for y, mask in zip(y_values, invalid)], axis=0)
+
+    valid_y = y_values[~invalid]
+    if valid_y.size >= 2:
+        low, high = np.percentile(valid_y, [5, 95])
+        scale = (high - low) or 1.0
+    else:
+        scale = 1.0
+
+    y = np.where(invalid, 0.0, y_values) / scale
+    scores = np.zeros(len(y) - 1)
+
+    # Deviation of each interior point from the chord through its neighbours
+    if len(y) >= 3:
+        bend = np.abs(y[1:-1] - (y[:-2] + y[2:]) / 2)
+        bend[invalid[:-2] | invalid[1:-1] | invalid[2:]] = 0
+        scores[:-1] = np.maximum(scores[:-1], bend)
+        scores[1:] = np.maximum(scores[1:], bend)
+
+    # Jumps over a large share of the plotted range suggest a discontinuity
+    jump = np.abs(np.diff(y))
+    jump[invalid[:-1] | invalid[1:]] = 0
+    scores = np.where(jump > jump_limit, np.maximum(scores, jump), scores)
+
+    # Edges of the plottable region always get refined
+    scores[invalid[:-1] != invalid[1:]] = np.inf
+    return scores
+
+
+def decimate_minmax(x_values, y_values, invalid, width):
+    """Reduce a sampled series to the minimum and maximum point of each of width x buckets
+
+    Buckets are split wherever the series has a gap, and one unplottable point
+    is kept per gap, so peaks and breaks in the curve survive decimation.
+    """
+    if len(x_values) <= 2 * width:
+        return x_values, y_values, invalid
+
+    if y_values.ndim > 1:
+        # Keep every point any function on the shared grid needs
+        keep = np.unique(np.concatenate([minmax_indices(x_values, y, mask, width) for y, mask in zip(y_values, invalid)]))
+    else:
+        keep = minmax_indices(x_values, y_values, invalid, width)
+
+    return x_values[keep], y_values[..., keep], invalid[..., keep]
+
+
+def minmax_indices(x_values, y_values, invalid, width):
+    """Indices of the points decimate_minmax keeps for a single series"""
+    span = x_values[-1] - x_values[0]
+    buckets = np.minimum(((x_values - x_values[0]) / span * width).astype(int), width - 1)
+
+    # Consecutive points share a group while they fall in the same bucket and on the same side of a gap
+    boundary = np.empty(len(x_values), dtype=bool)
+    boundary[0] = True
+    boundary[1:] = (np.diff(buckets) != 0) | (invalid[1:] != invalid[:-1])
+    groups = np.cumsum(boundary) - 1
+
+    # Within each group, order points by y so the group's first and last entries are its min and max
+    order = np.lexsort((np.where(invalid, 0.0, y_values), groups))
+    starts = np.flatnonzero(boundary)
+    ends = np.append(starts[1:], len(x_values)) - 1
+    return np.unique(np.concatenate([order[starts], order[ends][~invalid[starts]]]))
@@ -0,0 +1,233 @@
+import atexit
+import multiprocessing
+import os
+import threading
+
+from django.conf import settings
+
+from .timing import merge
+
+try:
+    import resource
+except ImportError:  # Windows: only the timeout applies
+    resource = None
+
+# Native math libraries otherwise start a thread per core in every worker
+WORKER_ENVIRONMENT = {
+    'OPENBLAS_NUM_THREADS': '1',
+    'OMP_NUM_THREADS': '1',
+    'MKL_NUM_THREADS': '1',
+}
+
+
+def worker_main(conn, memory_limit):
+    """Evaluate (data, angle_unit, decimal_places) tasks from conn until told to stop
+
+    Each reply is (ok, result or error message, stage timings or None).
+    """
+    os.environ.update(WORKER_ENVIRONMENT)
+    if resource is not None and memory_limit:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+    import django
+    django.setup()
+    from .timing import recording, timing_enabled
+    from .views import AdvancedCalculator, perform_calculation
+
+    calculators = {}
+    conn.send('ready')
+
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+
+        data, angle_unit, decimal_places = task
+        # Stage timings travel back with the result, for the parent's request
+        record = recording() if timing_enabled() else None
+        try:
+            calculator = calculators.get(angle_unit)
+            if calculator is None:
+                calculator = calculators[angle_unit] = AdvancedCalculator(angle_unit=angle_unit)
+            result = perform_calculation(data, calculator, decimal_places)
+            conn.send((True, result, record.stages if record else None))
+        except MemoryError:
+            conn.send((False, "Calculation error: result is too large", None))
+        except Exception as e:
+            conn.send((False, str(e), None))
+
+
+class SandboxWorker:
+    """One evaluation process and the parent's end of its pipe"""
+
+    def __init__(self, context, memory_limit):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=worker_main, args=(child_conn, memory_limit), name='kcalc-sandbox', daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.ready = False
+
+    def run(self, task, timeout, startup_timeout):
+        if not self.ready:
+            # Importing Django and NumPy does not count against the task timeout
+            if not self.conn.poll(startup_timeout):
+                raise TimeoutError
+            self.conn.recv()
+            self.ready = True
+
+        self.conn.send(task)
+        if not self.conn.poll(timeout):
+            raise TimeoutError
+        return self.conn.recv()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=1)
+        self.kill()
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class EvaluationPool:
+    """Pre-started pool of evaluation processes with a per-task timeout and memory limit
+
+    Workers are reused across tasks, keeping their expression caches warm.
+    A worker that overruns its timeout or dies is killed and replaced, so a
+    pathological expression costs one timeout instead of a stalled server.
+    type_timeouts maps calculation types to a timeout replacing timeout.
+    """
+
+    def __init__(self, size, timeout, memory_limit, startup_timeout=30, type_timeouts=None):
+        self.size = size
+        self.timeout = timeout
+        self.type_timeouts = type_timeouts or {}
+        self.memory_limit = memory_limit
+        self.startup_timeout = startup_timeout
+        self.pid = os.getpid()
+        # Forking a process with live threads can copy held locks into the child
+        self._context = multiprocessing.get_context('spawn')
+        self._available = threading.Condition()
+        self._workers = [self._start_worker() for _ in range(size)]
+        self._idle = list(self._workers)
+        self.tasks = 0
+        self.timeouts = 0
+        self.restarts = 0
+
+    def run(self, data, angle_unit, decimal_places, timeout=None):
+        """perform_calculation in a worker process, raising ValueError on failure or timeout
+
+        timeout, when given, caps the pool's own timeout for this task.
+        """
+        limit = self.type_timeouts.get(data.get('type', 'basic'), self.timeout)
+        timeout = limit if timeout is None else min(timeout, limit)
+        worker = self._acquire()
+        try:
+            ok, value, stages = worker.run((data, angle_unit, decimal_places), timeout, self.startup_timeout)
+        except TimeoutError:
+            worker = self._replace(worker, timed_out=True)
+            raise ValueError(f"Calculation timed out after {timeout:.3g} seconds")
+        except (EOFError, OSError):
+            worker = self._replace(worker)
+            raise ValueError("Calculation error: evaluation process stopped unexpectedly")
+        finally:
+            self._release(worker)
+
+        if not ok:
+            raise ValueError(value)
+        if stages:
+            merge(stages)
+        return value
+
+    def close(self):
+        with self._available:
+            workers, self._workers, self._idle = self._workers, [], []
+        for worker in workers:
+            worker.stop()
+
+    def stats(self):
+        with self._available:
+            return {
+                'workers': len(self._workers),
+                'idle': len(self._idle),
+                'tasks': self.tasks,
+                'timeouts': self.timeouts,
+                'restarts': self.restarts,
+            }
+
+    def _start_worker(self):
+        return SandboxWorker(self._context, self.memory_limit)
+
+    def _acquire(self):
+        with self._available:
+            if not self._available.wait_for(lambda: self._idle, timeout=self.timeout):
+                raise ValueError("Calculator is busy, please try again")
+            self.tasks += 1
+            # Most recently used first, its caches are the warmest
+            return self._idle.pop()
+
+    def _release(self, worker):
+        with self._available:
+            if worker in self._workers:
+                self._idle.append(worker)
+                self._available.notify()
+
+    def _replace(self, worker, timed_out=False):
+        worker.kill()
+        replacement = self._start_worker()
+        with self._available:
+            if worker in self._workers:
+                self._workers[self._workers.index(worker)] = replacement
+            self.restarts += 1
+            if timed_out:
+                self.timeouts += 1
+        return replacement
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def evaluation_pool():
+    """The process-wide EvaluationPool, started on first use"""
+    global _pool
+    with _pool_lock:
+        # A pool inherited through fork has no working pipes in the child
+        if _pool is None or _pool.pid != os.getpid():
+            _pool = EvaluationPool(
+                size=getattr(settings, 'KCALC_SANDBOX_WORKERS', None) or max(os.cpu_count() or 1, 2),
+                timeout=getattr(settings, 'KCALC_SANDBOX_TIMEOUT', 2.0),
+                memory_limit=getattr(settings, 'KCALC_SANDBOX_MEMORY_LIMIT', 1024 * 1024 * 1024),
+                type_timeouts=getattr(settings, 'KCALC_SANDBOX_TIMEOUTS', None),
+            )
+        return _pool
+
+
+def sandbox_stats():
+    """Stats of this process's EvaluationPool, None when it has not been started"""
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            return None
+        return _pool.stats()
+
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool.pid == os.getpid():
+            _pool.close()
+        _pool = None
+
+
+atexit.register(shutdown_pool)
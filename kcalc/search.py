@@ -0,0 +1,91 @@
+import re
+
+from django.db import connection
+from django.db.models import BooleanField, FloatField, Q
+from django.db.models.expressions import RawSQL
+
+# Contentless FTS5 table mirroring CalculationHistory, kept in sync by triggers (see migration 0003)
+SQLITE_FTS_TABLE = 'kcalc_history_fts'
+
+# Same document expression as the GIN index created for PostgreSQL
+POSTGRES_DOCUMENT = "to_tsvector('simple', expression || ' ' || result)"
+
+_fts_tables = {}
+
+
+def search_terms(query):
+    """Split a search box query into index terms, keeping decimal points inside numbers"""
+    return re.findall(r'[\w.]+', query)
+
+
+def sqlite_fts_available():
+    """Whether the FTS5 table exists on the current SQLite database"""
+    key = connection.settings_dict['NAME']
+    if key not in _fts_tables:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [SQLITE_FTS_TABLE])
+            _fts_tables[key] = cursor.fetchone() is not None
+    return _fts_tables[key]
+
+
+def use_sqlite_fts(terms):
+    return bool(terms) and connection.vendor == 'sqlite' and sqlite_fts_available()
+
+
+def sqlite_match(terms, user, session_key):
+    """Build an FTS5 query matching every term as a prefix within one owner's history"""
+    owner = f'u{user.pk}' if user else f's{session_key}'
+    words = ' AND '.join(f'"{term}"*' for term in terms)
+    return f'owner : "{owner}" AND {{expression result}} : ({words})'
+
+
+def postgres_tsquery(terms):
+    return ' & '.join(f"{term}:*" for term in terms)
+
+
+def search_history(history, query, user, session_key):
+    """Filter an owner's CalculationHistory queryset to rows matching query
+
+    Every term is matched as a word prefix in the expression or result.
+    Backends without a search index fall back to icontains.
+    """
+    terms = search_terms(query)
+
+    if use_sqlite_fts(terms):
+        return history.filter(id__in=RawSQL(
+            f"SELECT rowid FROM {SQLITE_FTS_TABLE} WHERE {SQLITE_FTS_TABLE} MATCH %s",
+            [sqlite_match(terms, user, session_key)]
+        ))
+
+    if terms and connection.vendor == 'postgresql':
+        return history.alias(search_match=RawSQL(
+            f"{POSTGRES_DOCUMENT} @@ to_tsquery('simple', %s)", [postgres_tsquery(terms)],
+            output_field=BooleanField()
+        )).filter(search_match=True)
+
+    # Queries without word characters, or no index; trigram indexes cover this on PostgreSQL
+    return history.filter(Q(expression__icontains=query) | Q(result__icontains=query))
+
+
+def ranked_history_ids(history, query, user, session_key):
+    """Ids of an owner's history rows matching query, best match first and newest first on ties"""
+    terms = search_terms(query)
+
+    if use_sqlite_fts(terms):
+        # The owner term keeps bm25 ranking to this owner's matches
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT rowid FROM {SQLITE_FTS_TABLE} WHERE {SQLITE_FTS_TABLE} MATCH %s ORDER BY rank, rowid DESC",
+                [sqlite_match(terms, user, session_key)]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    history = search_history(history, query, user, session_key)
+    if terms and connection.vendor == 'postgresql':
+        history = history.annotate(search_rank=RawSQL(
+            f"ts_rank({POSTGRES_DOCUMENT}, to_tsquery('simple', %s))", [postgres_tsquery(terms)],
+            output_field=FloatField()
+        )).order_by('-search_rank', '-timestamp')
+    else:
+        history = history.order_by('-timestamp')
+    return list(history.values_list('id', flat=True))
@@ -0,0 +1,373 @@
+import numpy as np
+from django.conf import settings
+
+from .matrices import eigen_result, parse_vector
+
+try:
+    import scipy.sparse
+    import scipy.sparse.linalg
+except ImportError:  # the NumPy fallbacks below are used instead
+    scipy = None
+
+# Sparse matrix_data formats:
+# {'format': 'coo', 'shape': [rows, cols], 'row': [...], 'col': [...], 'data': [...]}
+# {'format': 'csr', 'shape': [rows, cols], 'indptr': [...], 'indices': [...], 'data': [...]}
+SPARSE_FORMATS = ('coo', 'csr')
+SPARSE_ACTIONS = ('trace', 'rank', 'solve', 'eigenvalues')
+
+# eigenvalues 'which': largest magnitude, largest real part, smallest real part
+EIGENVALUE_ORDERS = ('LM', 'LR', 'SR')
+
+SOLVER_TOLERANCE = 1e-10
+# Up to this size a full dense eigendecomposition beats Krylov iteration
+DENSE_EIGENVALUE_SIZE = 500
+
+
+def is_sparse(matrix_data):
+    return isinstance(matrix_data, dict) and 'format' in matrix_data
+
+
+def max_dimension():
+    """Largest number of rows or columns accepted for a sparse matrix"""
+    return getattr(settings, 'KCALC_SPARSE_MAX_DIMENSION', 1000000)
+
+
+def dense_limit():
+    """Largest number of cells a sparse matrix is expanded to when no sparse algorithm applies"""
+    return getattr(settings, 'KCALC_SPARSE_DENSE_LIMIT', 4000000)
+
+
+class SparseMatrix:
+    """A matrix stored as coordinate triples; duplicate entries add up"""
+
+    def __init__(self, shape, row, col, data):
+        self.shape = shape
+        self.row = row
+        self.col = col
+        self.data = data
+
+    @classmethod
+    def from_request(cls, matrix_data):
+        fmt = matrix_data.get('format')
+        if fmt not in SPARSE_FORMATS:
+            raise ValueError(f"Sparse matrix format must be one of: {', '.join(SPARSE_FORMATS)}")
+
+        shape = matrix_data.get('shape')
+        if not isinstance(shape, list) or len(shape) != 2 or not all(isinstance(n, int) and n > 0 for n in shape):
+            raise ValueError("Sparse matrix shape must be [rows, columns]")
+        rows, cols = shape
+        # Work vectors are sized from the shape, so it must not exceed what is sensible to allocate
+        if max(rows, cols) > max_dimension():
+            raise ValueError(f"Sparse matrix dimensions can be at most {max_dimension()}")
+
+        try:
+            data = np.asarray(matrix_data.get('data', []), dtype=float)
+            if fmt == 'coo':
+                row = np.asarray(matrix_data.get('row', []), dtype=np.int64)
+                col = np.asarray(matrix_data.get('col', []), dtype=np.int64)
+            else:
+                indptr = np.asarray(matrix_data.get('indptr', []), dtype=np.int64)
+                col = np.asarray(matrix_data.get('indices', []), dtype=np.int64)
+                if indptr.shape != (rows + 1,) or indptr[0] != 0 or np.any(np.diff(indptr) < 0):
+                    raise ValueError("Sparse matrix indptr must rise from 0 and have rows + 1 entries")
+                if indptr[-1] != len(col):
+                    raise ValueError("Sparse matrix indptr does not match its indices")
+                row = np.repeat(np.arange(rows), np.diff(indptr))
+        except (ValueError, TypeError, OverflowError):
+            raise ValueError("Sparse matrix indices must be integers and data must be numbers")
+
+        if not (data.ndim == row.ndim == col.ndim == 1 and len(data) == len(row) == len(col)):
+            raise ValueError("Sparse matrix data and indices must be lists of equal length")
+        if len(data) and (row.min() < 0 or row.max() >= rows or col.min() < 0 or col.max() >= cols):
+            raise ValueError("Sparse matrix index out of range")
+
+        return cls((rows, cols), row, col, data)
+
+    @property
+    def nnz(self):
+        return len(self.data)
+
+    def matvec(self, x):
+        return np.bincount(self.row, weights=self.data * x[self.col], minlength=self.shape[0])
+
+    def diagonal(self):
+        on_diagonal = self.row == self.col
+        return np.bincount(self.row[on_diagonal], weights=self.data[on_diagonal], minlength=min(self.shape))
+
+    def trace(self):
+        return float(self.data[self.row == self.col].sum())
+
+    def canonical(self, transpose=False):
+        """Sorted linear indices and values of the nonzero entries, duplicates summed"""
+        row, col = (self.col, self.row) if transpose else (self.row, self.col)
+        keys, inverse = np.unique(row * self.shape[1] + col, return_inverse=True)
+        values = np.bincount(inverse, weights=self.data, minlength=len(keys))
+        nonzero = values != 0
+        return keys[nonzero], values[nonzero]
+
+    def is_symmetric(self):
+        if self.shape[0] != self.shape[1]:
+            return False
+        keys, values = self.canonical()
+        transposed_keys, transposed_values = self.canonical(transpose=True)
+        if not np.array_equal(keys, transposed_keys):
+            return False
+        return not len(values) or np.abs(values - transposed_values).max() <= 1e-12 * np.abs(values).max()
+
+    def to_dense(self):
+        if self.shape[0] * self.shape[1] > dense_limit():
+            raise ValueError(f"Sparse matrix is too large for this operation ({self.shape[0]}x{self.shape[1]})")
+        dense = np.zeros(self.shape)
+        np.add.at(dense, (self.row, self.col), self.data)
+        return dense
+
+    def to_scipy(self):
+        return scipy.sparse.csr_matrix((self.data, (self.row, self.col)), shape=self.shape)
+
+
+def sparse_calculation(matrix_data, action, options=None):
+    """Run a matrix action on sparse matrix_data without expanding it where possible"""
+    if action not in SPARSE_ACTIONS:
+        raise ValueError(f"Sparse matrices support only: {', '.join(SPARSE_ACTIONS)}")
+
+    matrix = SparseMatrix.from_request(matrix_data)
+    options = options or {}
+    if action != 'rank' and matrix.shape[0] != matrix.shape[1]:
+        raise ValueError(f"Matrix must be square for {action} calculation")
+
+    if action == 'trace':
+        return matrix.trace()
+    elif action == 'rank':
+        return sparse_rank(matrix)
+    elif action == 'solve':
+        rhs = options.get('b')
+        if rhs is None:
+            raise ValueError("Solving a linear system requires a right-hand side b")
+        return sparse_solve(matrix, parse_vector(rhs))
+    else:
+        k = options.get('k', 6)
+        which = options.get('which', 'LM')
+        if not isinstance(k, int) or not 0 < k <= matrix.shape[0]:
+            raise ValueError(f"k must be a whole number from 1 to {matrix.shape[0]}")
+        if which not in EIGENVALUE_ORDERS:
+            raise ValueError(f"which must be one of: {', '.join(EIGENVALUE_ORDERS)}")
+        return sparse_eigenvalues(matrix, k, which, options.get('eigenvectors', False))
+
+
+def sparse_rank(matrix):
+    """Rank of the dense matrix left after dropping empty rows and columns
+
+    Neither SciPy nor NumPy computes a numerical rank from sparse storage,
+    but empty rows and columns never add to it, which shrinks banded and
+    block inputs with unused indices. Symmetric matrices take the much
+    cheaper eigvalsh, whose absolute values are their singular values.
+    """
+    nonzero = matrix.data != 0
+    if matrix.is_symmetric():
+        # Rows and columns are used alike, compacting both the same way keeps the symmetry
+        used, index = np.unique(np.concatenate([matrix.row[nonzero], matrix.col[nonzero]]), return_inverse=True)
+        if not len(used):
+            return 0
+        row, col = np.split(index, 2)
+        compact = SparseMatrix((len(used), len(used)), row, col, matrix.data[nonzero])
+        singular = np.abs(np.linalg.eigvalsh(compact.to_dense()))
+        return int(np.count_nonzero(singular > singular.max() * len(used) * np.finfo(float).eps))
+
+    rows, row = np.unique(matrix.row[nonzero], return_inverse=True)
+    cols, col = np.unique(matrix.col[nonzero], return_inverse=True)
+    if not len(rows):
+        return 0
+    compact = SparseMatrix((len(rows), len(cols)), row, col, matrix.data[nonzero])
+    return int(np.linalg.matrix_rank(compact.to_dense()))
+
+
+def sparse_solve(matrix, rhs):
+    """Solve matrix @ x = rhs: a sparse direct solve with SciPy, otherwise BiCGSTAB"""
+    n = matrix.shape[0]
+    if rhs.shape[0] != n:
+        raise ValueError(f"Right-hand side must have {n} rows")
+
+    if scipy is not None:
+        with np.errstate(all='ignore'):
+            result = scipy.sparse.linalg.spsolve(matrix.to_scipy().tocsc(), rhs)
+        result = np.asarray(result).reshape(rhs.shape)
+    elif n * n <= dense_limit():
+        try:
+            result = np.linalg.solve(matrix.to_dense(), rhs)
+        except np.linalg.LinAlgError:
+            raise ValueError("Matrix is singular, the system has no unique solution")
+    elif rhs.ndim == 1:
+        result = bicgstab(matrix, rhs)
+    else:
+        result = np.column_stack([bicgstab(matrix, column) for column in rhs.T])
+
+    if not np.all(np.isfinite(result)):
+        raise ValueError("Matrix is singular, the system has no unique solution")
+    return result
+
+
+def bicgstab(matrix, b, tolerance=SOLVER_TOLERANCE):
+    """Jacobi-preconditioned BiCGSTAB for one right-hand side"""
+    b_norm = np.linalg.norm(b)
+    if b_norm == 0:
+        return np.zeros_like(b)
+
+    diagonal = matrix.diagonal()
+    inverse_diagonal = np.divide(1.0, diagonal, out=np.ones_like(diagonal), where=diagonal != 0)
+
+    x = np.zeros_like(b)
+    r = b.copy()
+    r_hat = b.copy()
+    p = v = np.zeros_like(b)
+    rho = alpha = omega = 1.0
+
+    for _ in range(max(1000, 2 * len(b))):
+        rho_next = r_hat @ r
+        if rho_next == 0:
+            break
+        p = r + (rho_next / rho) * (alpha / omega) * (p - omega * v)
+        p_hat = inverse_diagonal * p
+        v = matrix.matvec(p_hat)
+        if r_hat @ v == 0:
+            break
+        alpha = rho_next / (r_hat @ v)
+        s = r - alpha * v
+        if np.linalg.norm(s) <= tolerance * b_norm:
+            return x + alpha * p_hat
+
+        s_hat = inverse_diagonal * s
+        t = matrix.matvec(s_hat)
+        if t @ t == 0:
+            break
+        omega = (t @ s) / (t @ t)
+        x = x + alpha * p_hat + omega * s_hat
+        r = s - omega * t
+        if np.linalg.norm(r) <= tolerance * b_norm:
+            return x
+        if omega == 0:
+            break
+        rho = rho_next
+
+    raise ValueError("Sparse solver did not converge, the matrix may be singular or ill-conditioned")
+
+
+def select_eigenvalues(values, k, which):
+    if which == 'LM':
+        order = np.argsort(-np.abs(values), kind='stable')
+    elif which == 'LR':
+        order = np.argsort(-values.real, kind='stable')
+    else:
+        order = np.argsort(values.real, kind='stable')
+    return order[:k]
+
+
+def sparse_eigenvalues(matrix, k, which, vectors=False):
+    """eigen_result of the k extreme eigenvalues selected by which, from a Krylov method where the matrix is large"""
+    n = matrix.shape[0]
+    symmetric = matrix.is_symmetric()
+    if n <= DENSE_EIGENVALUE_SIZE:
+        values, eigenvectors = np.linalg.eig(matrix.to_dense())
+    elif scipy is not None and k < n - 1:
+        csr = matrix.to_scipy()
+        if symmetric:
+            values, eigenvectors = scipy.sparse.linalg.eigsh(csr, k=k, which={'LM': 'LM', 'LR': 'LA', 'SR': 'SA'}[which])
+        else:
+            values, eigenvectors = scipy.sparse.linalg.eigs(csr, k=k, which=which)
+    else:
+        values, eigenvectors = krylov_schur(matrix, k, which, symmetric)
+
+    chosen = select_eigenvalues(values, k, which)
+    return eigen_result(values[chosen], eigenvectors[:, chosen] if vectors else None)
+
+
+def krylov_schur(matrix, k, which, symmetric, tolerance=1e-10, max_restarts=300):
+    """Extreme eigenvalues and eigenvectors from a restarted Arnoldi (Lanczos when symmetric) iteration
+
+    Each cycle extends the Krylov space to a fixed size and then shrinks it
+    back to the span of the best Ritz vectors, which keeps memory and
+    orthogonalization cost bounded however slowly clustered eigenvalues
+    converge. An exhausted (invariant) Krylov space is extended with a new
+    random direction, so repeated eigenvalues are all found.
+    """
+    n = matrix.shape[0]
+    size = min(n, max(2 * k + 1, k + 60))
+    # One more column may join to complete a complex conjugate pair
+    keep = min((size + k) // 2, size - 2)
+    rng = np.random.default_rng(0)
+
+    # One basis vector per row, so each is contiguous
+    basis = np.zeros((size + 1, n))
+    projected = np.zeros((size + 1, size))
+    start = rng.standard_normal(n)
+    basis[0] = start / np.linalg.norm(start)
+    filled = 0
+
+    for _ in range(max_restarts):
+        for j in range(filled, size):
+            w = matrix.matvec(basis[j])
+            # Classical Gram-Schmidt, done twice to keep the basis orthogonal
+            h = basis[:j + 1] @ w
+            w -= h @ basis[:j + 1]
+            correction = basis[:j + 1] @ w
+            w -= correction @ basis[:j + 1]
+            projected[:j + 1, j] = h + correction
+            norm = np.linalg.norm(w)
+            if norm <= 1e-12 * np.linalg.norm(projected[:j + 2, j]):
+                # The Krylov space is invariant: its eigenvalues are exact, carry on from a new direction
+                norm = 0.0
+                w = new_direction(basis[:j + 1], rng)
+                if w is None:
+                    size = j + 1
+                    break
+            projected[j + 1, j] = norm
+            basis[j + 1] = w / np.linalg.norm(w)
+
+        square = projected[:size, :size]
+        if symmetric:
+            values, ritz = np.linalg.eigh((square + square.T) / 2)
+        else:
+            values, ritz = np.linalg.eig(square)
+        order = select_eigenvalues(values, size, which)
+        values, ritz = values[order], ritz[:, order]
+
+        residuals = np.abs(projected[size, size - 1] * ritz[size - 1, :k])
+        scale = tolerance * max(np.abs(values).max(), np.finfo(float).tiny)
+        if size == n or np.all(residuals <= scale):
+            values = values[:k]
+            # Rounding leaves real eigenvalues of nonsymmetric matrices with tiny imaginary parts
+            values = np.where(np.abs(values.imag) <= scale, values.real, values)
+            return values, (ritz[:, :k].T @ basis[:size]).T
+
+        # Restart from the span of the best Ritz vectors, A V = V B + f b^T
+        span = restart_span(ritz, keep)
+        filled = span.shape[1]
+        projected[:filled, :filled] = span.T @ square @ span
+        projected[filled, :filled] = projected[size, size - 1] * span[size - 1]
+        projected[:filled + 1, filled:] = 0
+        projected[filled + 1:] = 0
+        basis[:filled] = span.T @ basis[:size]
+        basis[filled] = basis[size]
+
+    raise ValueError(f"Eigenvalue iteration did not converge after {max_restarts} restarts, try a smaller k")
+
+
+def new_direction(basis, rng):
+    """A random vector orthogonal to the rows of basis, None when they already span the whole space"""
+    if basis.shape[0] >= basis.shape[1]:
+        return None
+    w = rng.standard_normal(basis.shape[1])
+    for _ in range(2):
+        w -= (basis @ w) @ basis
+    return w
+
+
+def restart_span(ritz, keep):
+    """Orthonormal real basis of the first keep Ritz vectors, keeping complex conjugate pairs together"""
+    columns = []
+    for vector in ritz[:, :keep].T:
+        if np.iscomplexobj(vector) and np.any(vector.imag):
+            columns.extend([vector.real, vector.imag])
+        else:
+            columns.append(vector.real)
+    span, singular, _ = np.linalg.svd(np.column_stack(columns), full_matrices=False)
+    return span[:, singular > singular[0] * 1e-10]
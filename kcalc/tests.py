@@ -1,3 +1,617 @@
-from django.test import TestCase
+import gzip
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DatabaseError, connection
+from django.db.models import F
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import path, resolve
+from django.utils import timezone
+
+from . import views
+from .history import HistoryWriter, flush_history
+from .models import CalculationHistory, UserPreferences
+from .sandbox import sandbox_stats, shutdown_pool
+from .search import sqlite_fts_available
+from .views import AdvancedCalculator, expression_cache, import_settings_api
+
+
+def banded(n, lower, diagonal, upper):
+    """A tridiagonal matrix as sparse coordinate matrix_data"""
+    i = np.arange(n)
+    return {
+        'format': 'coo',
+        'shape': [n, n],
+        'row': np.concatenate([i, i[:-1], i[1:]]).tolist(),
+        'col': np.concatenate([i, i[1:], i[:-1]]).tolist(),
+        'data': [diagonal] * n + [upper] * (n - 1) + [lower] * (n - 1),
+    }
+
+
+def balanced_product(terms):
+    """terms multiplied as a balanced tree, ((a*b)*(c*d))*..."""
+    while len(terms) > 1:
+        terms = [f'({a}*{b})' for a, b in zip(terms[::2], terms[1::2])] + terms[len(terms) - len(terms) % 2:]
+    return terms[0]
+
+
+class EvaluatorTests(TestCase):
+    def setUp(self):
+        expression_cache.clear()
+
+    def calculate(self, expression, calc_type='scientific'):
+        response = self.client.post('/api/calculate/', json.dumps({'expression': expression, 'type': calc_type}),
+                                    content_type='application/json')
+        return response.json()
+
+    def test_only_whitelisted_names_and_syntax(self):
+        calculator = AdvancedCalculator()
+        for expression, message in (
+            ("__import__('os')", 'Unknown function: __import__'),
+            ("().__class__", 'Unsupported expression: Attribute'),
+            ('x+1', 'Unknown name: x'),
+            ('foo(1)', 'Unknown function: foo'),
+            ('lambda: 1', 'Unsupported expression: Lambda'),
+            ("'a'*3", 'Unsupported literal'),
+            ('[1, 2]', 'Unsupported expression: List'),
+            ('sin', "Function 'sin' must be called with arguments"),
+            ('sin(x=1)', r'Invalid arguments for sin\(\)'),
+        ):
+            with self.subTest(expression=expression):
+                with self.assertRaisesRegex(ValueError, f'^Calculation error: {message}'):
+                    calculator.evaluate(expression)
+
+    def test_math_errors(self):
+        self.assertEqual(self.calculate('1/0'), {'error': 'Calculation error: division by zero', 'success': False})
+        self.assertEqual(self.calculate('sqrt(-1)')['error'], 'Calculation error: math domain error')
+
+    def test_degree_mode(self):
+        degrees = AdvancedCalculator('deg')
+        self.assertAlmostEqual(degrees.evaluate('sin(30)'), 0.5)
+        self.assertAlmostEqual(degrees.evaluate('asin(0.5)'), 30)
+        # Compiled expressions are cached per angle unit
+        self.assertAlmostEqual(AdvancedCalculator().evaluate('sin(30)'), -0.9880316241)
+        self.assertAlmostEqual(degrees.evaluate('sin(30)'), 0.5)
+
+    def test_exact_integers(self):
+        self.assertEqual(self.calculate('2**64+1', 'basic')['result'], '18446744073709551617')
+        self.assertEqual(self.calculate('factorial(25)')['result'], '15511210043330985984000000')
+        self.assertEqual(self.calculate('2^10')['result'], '1024')
+
+    def test_cached_results(self):
+        calculator = AdvancedCalculator()
+        self.assertEqual(calculator.evaluate('2+3*4'), 14)
+        hits = expression_cache.stats()['hits']
+        self.assertEqual(calculator.evaluate(' 2+3*4 '), 14)
+        self.assertEqual(expression_cache.stats()['hits'], hits + 1)
+
+
+    def test_decimal_places_beyond_float_precision(self):
+        self.client.post('/api/preferences/', json.dumps({'decimal_places': 40}), content_type='application/json')
+        self.assertEqual(self.calculate('1/3')['result'], '0.' + '3' * 40)
+        self.assertEqual(self.calculate('sqrt(2)')['result'], '1.4142135623730950488016887242096980785697')
+        self.assertEqual(self.calculate('sin(pi/6)')['result'], '0.5')
+
+        self.client.post('/api/preferences/', json.dumps({'angle_unit': 'deg'}), content_type='application/json')
+        self.assertEqual(self.calculate('sin(30)')['result'], '0.5')
+        self.assertEqual(self.calculate('asin(0.5)')['result'], '30')
+
+    def test_float_is_kept_within_its_precision(self):
+        self.assertIsInstance(AdvancedCalculator().evaluate('1/3', 10), float)
+        self.assertIsInstance(AdvancedCalculator().evaluate('1/3', 30), Decimal)
+        self.assertEqual(self.calculate('1/3')['result'], '0.3333333333')
+
+class ExpressionCostTests(TestCase):
+    def setUp(self):
+        expression_cache.clear()
+
+    def evaluate(self, expression):
+        return AdvancedCalculator().evaluate(expression)
+
+    def test_large_products_are_refused(self):
+        for expression in (balanced_product(['factorial(7000)'] * 190), '*'.join(['factorial(7000)'] * 180)):
+            with self.assertRaisesRegex(ValueError, 'too large to compute exactly'):
+                self.evaluate(expression)
+
+    def test_large_sums_and_quotients_are_refused(self):
+        with self.assertRaisesRegex(ValueError, 'too large to compute exactly'):
+            self.evaluate('+'.join(['2**99999'] * 4))
+        with self.assertRaisesRegex(ValueError, 'too large to compute exactly'):
+            self.evaluate('(factorial(7000)*factorial(7000))//3')
+
+    def test_exact_integers_within_limit(self):
+        self.assertEqual(self.evaluate('factorial(7000)//factorial(6998)'), 7000 * 6999)
+        self.assertEqual(self.evaluate('2**64+1'), float(2 ** 64 + 1))
+
+    @override_settings(KCALC_EXPENSIVE_EXPRESSIONS='approximate')
+    def test_large_products_are_approximated(self):
+        self.assertEqual(self.evaluate('*'.join(['factorial(7000)'] * 3)), 'Infinity')
+        self.assertEqual(self.evaluate('-factorial(7000)*factorial(7000)'), '-Infinity')
+        self.assertEqual(self.evaluate('1.5*factorial(7000)*factorial(7000)'), 'Infinity')
+
+    def test_long_flat_expressions(self):
+        self.assertEqual(self.evaluate('+'.join(['1'] * 300)), 300)
+        self.assertEqual(self.evaluate('*'.join(['1'] * 2000)), 1)
+        self.assertEqual(self.evaluate('1' + '-2+3' * 500), 501)
+
+    def test_deep_nesting_is_refused(self):
+        self.assertEqual(self.evaluate('(' * 150 + '1' + ')' * 150), 1)
+        with self.assertRaisesRegex(ValueError, 'nested too deeply'):
+            self.evaluate('-' * 250 + '1')
+        with self.assertRaisesRegex(ValueError, 'too long to parse'):
+            self.evaluate('+'.join(['1'] * 5000))
+
+
+class GraphTests(TestCase):
+    def plot(self, **data):
+        response = self.client.post('/api/calculate/', json.dumps({'type': 'graph', 'action': 'plot', **data}),
+                                    content_type='application/json')
+        return response.json()
+
+    def test_history_records_plot_size(self):
+        result = self.plot(expression='sin(x)', num_points=100000)
+        self.assertEqual(len(result['result']['y_values']), 100001)
+        self.plot(functions=['sin(x)', 'x**2', '1/x'], num_points=1000)
+
+        self.assertEqual(
+            list(CalculationHistory.objects.order_by('id').values_list('expression', 'result')),
+            [('sin(x)', '1 function, 100001 points'), ('sin(x); x**2; 1/x', '3 functions, 1001 points')]
+        )
+
+
+class MatrixTests(TestCase):
+    def calculate(self, matrix_data, action, **data):
+        response = self.client.post('/api/calculate/', json.dumps({
+            'type': 'matrix', 'action': action, 'matrix_data': matrix_data, **data,
+        }), content_type='application/json')
+        return response.json()
+
+    def test_history_records_large_matrices_by_shape(self):
+        large = (2 * np.eye(20)).tolist()
+        self.calculate([[2, 0], [0, 4]], 'inv')
+        self.calculate(large, 'inv')
+        self.calculate(large, 'inv', response_format='base64')
+        self.calculate(large, 'qr')
+        self.calculate((2 * np.eye(60)).tolist(), 'eigenvalues')
+
+        self.assertEqual(list(CalculationHistory.objects.order_by('id').values_list('result', flat=True)), [
+            "[['0.5', '0'], ['0', '0.25']]",
+            '20x20 matrix',
+            '20x20 matrix',
+            'Q: 20x20 matrix, R: 20x20 matrix',
+            'real: 60-element vector, imag: 60-element vector',
+        ])
+
+
+    def test_determinant_of_non_finite_matrix(self):
+        # Sent as Infinity, as a typed 1e400 is parsed
+        result = self.calculate([[1e400, 1], [2, 3]], 'det')
+        self.assertEqual(result['error'],
+                         'Matrix calculation error: Matrix must contain only finite numbers for determinant calculation')
+        result = self.calculate([[[1e400, 1], [2, 3]], [[1, 2], [3, 4]]], 'det')['result']
+        self.assertEqual(result['results'][1], '-2')
+        self.assertEqual(result['errors'],
+                         ['Matrix must contain only finite numbers for determinant calculation', None])
+
+class HistoryTests(TestCase):
+    def setUp(self):
+        for expression in ('1+1', '2+2', '3+3'):
+            self.client.post('/api/calculate/', json.dumps({'expression': expression}), content_type='application/json')
+
+    def test_cursor_pages_walk_all_rows(self):
+        expressions = []
+        cursor = ''
+        while cursor is not None:
+            page = self.client.get('/api/history/', {'cursor': cursor, 'per_page': 2}).json()
+            expressions += [row['expression'] for row in page['history']]
+            cursor = page['next_cursor']
+        self.assertEqual(expressions, ['3+3', '2+2', '1+1'])
+
+    def test_per_page_is_at_least_one(self):
+        page = self.client.get('/api/history/', {'cursor': '', 'per_page': 0}).json()
+        self.assertEqual(len(page['history']), 1)
+        self.assertTrue(page['has_next'])
+        page = self.client.get('/api/history/', {'page': 1, 'per_page': -5}).json()
+        self.assertEqual(page['total_pages'], 3)
+
+    def search(self, query, client=None):
+        """Expressions found by query, in page-number order and ranked, with the ranked match count"""
+        client = client or self.client
+        found = client.get('/api/history/', {'search': query}).json()
+        ranked = client.get('/api/history/', {'search': query, 'order': 'relevance'}).json()
+        return (
+            sorted(row['expression'] for row in found['history']),
+            sorted(row['expression'] for row in ranked['history']),
+            ranked['total_count'],
+        )
+
+    def test_search_index_follows_inserts_updates_and_deletes(self):
+        self.assertTrue(sqlite_fts_available())
+        self.client.post('/api/calculate/', json.dumps({'expression': 'sqrt(144)', 'type': 'scientific'}),
+                         content_type='application/json')
+        self.assertEqual(self.search('sqr'), (['sqrt(144)'], ['sqrt(144)'], 1))
+        self.assertEqual(self.search('12'), (['sqrt(144)'], ['sqrt(144)'], 1))
+
+        flush_history()
+        CalculationHistory.objects.filter(expression='2+2').update(expression='cos(0)')
+        self.assertEqual(self.search('cos'), (['cos(0)'], ['cos(0)'], 1))
+
+        CalculationHistory.objects.filter(expression='sqrt(144)').delete()
+        self.assertEqual(self.search('sqrt'), ([], [], 0))
+
+        self.client.post('/api/clear-history/')
+        self.assertEqual(self.search('cos'), ([], [], 0))
+        self.assertEqual(self.search('3'), ([], [], 0))
+
+    def test_search_is_scoped_to_the_owner(self):
+        other = Client()
+        other.post('/api/calculate/', json.dumps({'expression': '3+30'}), content_type='application/json')
+        self.assertEqual(self.search('3'), (['3+3'], ['3+3'], 1))
+        self.assertEqual(self.search('3', other), (['3+30'], ['3+30'], 1))
+
+        self.client.post('/api/clear-history/')
+        self.assertEqual(self.search('3'), ([], [], 0))
+        self.assertEqual(self.search('3', other), (['3+30'], ['3+30'], 1))
+
+    def export(self, **params):
+        response = self.client.get('/api/export-history/', params)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        return [line.split(',')[0] for line in lines[1:]]
+
+    def test_export_end_date_is_inclusive(self):
+        today = timezone.localdate()
+        self.assertEqual(self.export(end=today.isoformat()), ['3+3', '2+2', '1+1'])
+        self.assertEqual(self.export(start=today.isoformat()), ['3+3', '2+2', '1+1'])
+        self.assertEqual(self.export(end=(today - timedelta(days=1)).isoformat()), [])
+        self.assertEqual(self.export(start=(today + timedelta(days=1)).isoformat()), [])
+
+    def test_export_datetime_bounds(self):
+        now = timezone.localtime()
+        self.assertEqual(self.export(end=(now - timedelta(hours=1)).isoformat()), [])
+        self.assertEqual(self.export(start=(now - timedelta(hours=1)).isoformat(), type='basic'),
+                         ['3+3', '2+2', '1+1'])
+
+    async def test_export_streams_under_asgi(self):
+        for expression in ('4+4', '5+5'):
+            await self.async_client.post('/api/calculate/', json.dumps({'expression': expression}),
+                                         content_type='application/json')
+        for params, decode in (({}, bytes.decode), ({'gzip': 1}, lambda data: gzip.decompress(data).decode())):
+            response = await self.async_client.get('/api/export-history/', params)
+            # An async body is streamed chunk by chunk instead of being read into a list first
+            self.assertTrue(response.is_async)
+            lines = decode(b''.join([chunk async for chunk in response.streaming_content])).splitlines()
+            self.assertEqual([line.split(',')[0] for line in lines], ['Expression', '5+5', '4+4'])
+
+
+# Flushes run in the test thread, inside the test transaction, instead of a background thread
+@mock.patch.object(HistoryWriter, '_start', lambda self: None)
+class HistoryWriterTests(TestCase):
+    def setUp(self):
+        self.writer = HistoryWriter()
+        patcher = mock.patch('kcalc.history.writer', self.writer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def calculate(self, expression):
+        self.client.post('/api/calculate/', json.dumps({'expression': expression}), content_type='application/json')
+
+    def expressions(self):
+        return list(CalculationHistory.objects.order_by('id').values_list('expression', flat=True))
+
+    @override_settings(KCALC_HISTORY_DURABILITY='buffered')
+    def test_queued_rows_are_written_on_flush(self):
+        self.calculate('1+1')
+        self.calculate('2+2')
+        self.assertEqual((self.expressions(), self.writer.stats()['queue_depth']), ([], 2))
+
+        flush_history()
+        self.assertEqual(self.expressions(), ['1+1', '2+2'])
+        self.assertEqual(self.writer.stats()['rows_written'], 2)
+
+    @override_settings(KCALC_HISTORY_DURABILITY='sync')
+    def test_sync_durability_writes_inline(self):
+        self.calculate('1+1')
+        self.assertEqual((self.expressions(), self.writer.stats()['queue_depth']), (['1+1'], 0))
+
+    @override_settings(KCALC_HISTORY_DURABILITY='buffered')
+    def test_failed_flush_keeps_the_queue(self):
+        self.calculate('1+1')
+        self.calculate('2+2')
+        with mock.patch.object(CalculationHistory.objects, 'bulk_create', side_effect=DatabaseError('disk full')):
+            with self.assertRaises(DatabaseError):
+                flush_history()
+        self.assertEqual(self.writer.stats()['queue_depth'], 2)
+        self.assertEqual(self.writer.stats()['failed_flushes'], 1)
+
+        # Rows queued since are written after the ones that failed
+        self.calculate('3+3')
+        flush_history()
+        self.assertEqual(self.expressions(), ['1+1', '2+2', '3+3'])
+
+
+class MemoryTests(TestCase):
+    def post(self, url, data):
+        return self.client.post(url, json.dumps(data), content_type='application/json').json()
+
+    def racing_memory_add(self):
+        """Patch get_or_create so that an M+ from another tab lands between the read and the save"""
+        get_or_create = UserPreferences.objects.get_or_create
+
+        def racing_get_or_create(*args, **kwargs):
+            prefs, created = get_or_create(*args, **kwargs)
+            UserPreferences.objects.filter(pk=prefs.pk).update(memory_value=F('memory_value') + 1)
+            return prefs, created
+
+        async def racing_aget_or_create(*args, **kwargs):
+            return await sync_to_async(racing_get_or_create)(*args, **kwargs)
+
+        # Either view may be routed, see KCALC_ASYNC_VIEWS
+        return mock.patch.multiple(
+            UserPreferences.objects, get_or_create=racing_get_or_create, aget_or_create=racing_aget_or_create
+        )
+
+    def test_preferences_post_keeps_concurrent_memory_update(self):
+        self.post('/api/memory/', {'action': 'store', 'value': 5})
+        with self.racing_memory_add():
+            self.assertTrue(self.post('/api/preferences/', {'theme': 'light'})['success'])
+
+        preferences = self.client.get('/api/preferences/').json()
+        self.assertEqual((preferences['theme'], preferences['memory_value']), ('light', 6.0))
+
+    def test_settings_import_keeps_concurrent_memory_update(self):
+        self.post('/api/memory/', {'action': 'store', 'value': 5})
+        # import_settings_api has no route, call it with this client's session
+        request = RequestFactory().post('/', {
+            'settings_file': SimpleUploadedFile('settings.json', json.dumps({'angle_unit': 'deg'}).encode()),
+        })
+        request.user = AnonymousUser()
+        request.session = self.client.session
+        with self.racing_memory_add():
+            self.assertEqual(import_settings_api(request).status_code, 200)
+
+        preferences = self.client.get('/api/preferences/').json()
+        self.assertEqual((preferences['angle_unit'], preferences['memory_value']), ('deg', 6.0))
+
+
+class MemoryConcurrencyTests(TransactionTestCase):
+    THREADS = 8
+    ADDS = 25
+
+    def test_concurrent_memory_add(self):
+        self.client.post('/api/memory/', json.dumps({'action': 'store', 'value': 0}), content_type='application/json')
+
+        def add_repeatedly(_):
+            # One client per thread, all in the same session, like several open tabs
+            client = Client()
+            client.cookies = self.client.cookies
+            try:
+                return [
+                    client.post('/api/memory/', json.dumps({'action': 'add', 'value': 0.5}),
+                                content_type='application/json').status_code
+                    for _ in range(self.ADDS)
+                ]
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(self.THREADS) as executor:
+            statuses = sum(executor.map(add_repeatedly, range(self.THREADS)), [])
+
+        self.assertEqual(statuses, [200] * self.THREADS * self.ADDS)
+        recalled = self.client.post('/api/memory/', json.dumps({'action': 'recall'}), content_type='application/json')
+        self.assertEqual(recalled.json()['value'], 0.5 * self.THREADS * self.ADDS)
+
+
+# The async API views, whatever KCALC_ASYNC_VIEWS is; AsyncViewTests routes through these
+urlpatterns = [
+    path('api/calculate/', views.acalculate_api),
+    path('api/preferences/', views.apreferences_api),
+    path('api/history/', views.ahistory_api),
+    path('api/memory/', views.amemory_api),
+]
+
+
+@override_settings(ROOT_URLCONF=__name__)
+class AsyncViewTests(TestCase):
+    async def post(self, url, data):
+        return await self.async_client.post(url, json.dumps(data), content_type='application/json')
+
+    def test_routes_are_async(self):
+        for url in ('/api/calculate/', '/api/preferences/', '/api/history/', '/api/memory/'):
+            self.assertTrue(iscoroutinefunction(resolve(url).func), url)
+
+    async def test_calculate(self):
+        response = await self.post('/api/calculate/', {'expression': '2+3*4'})
+        self.assertEqual(response.json(), {'result': '14', 'expression': '2+3*4', 'success': True})
+        response = await self.post('/api/calculate/', {'expression': '1/0'})
+        self.assertEqual((response.status_code, response.json()['error']), (400, 'Calculation error: division by zero'))
+
+    async def test_preferences(self):
+        response = await self.post('/api/preferences/', {'theme': 'light', 'angle_unit': 'deg'})
+        self.assertTrue(response.json()['success'])
+        preferences = (await self.async_client.get('/api/preferences/')).json()
+        self.assertEqual((preferences['theme'], preferences['angle_unit']), ('light', 'deg'))
+        # The cached preferences are used by the next calculation
+        response = await self.post('/api/calculate/', {'expression': 'sin(30)', 'type': 'scientific'})
+        self.assertEqual(response.json()['result'], '0.5')
+
+    async def test_history(self):
+        for expression in ('1+1', '2+2', 'sqrt(9)'):
+            await self.post('/api/calculate/', {'expression': expression, 'type': 'scientific'})
+
+        page = (await self.async_client.get('/api/history/', {'per_page': 2})).json()
+        self.assertEqual([row['expression'] for row in page['history']], ['sqrt(9)', '2+2'])
+        self.assertEqual((page['total_count'], page['total_pages']), (3, 2))
+
+        page = (await self.async_client.get('/api/history/', {'cursor': '', 'per_page': 2})).json()
+        page = (await self.async_client.get('/api/history/', {'cursor': page['next_cursor'], 'per_page': 2})).json()
+        self.assertEqual(([row['expression'] for row in page['history']], page['next_cursor']), (['1+1'], None))
+
+        for order in ('', 'relevance'):
+            page = (await self.async_client.get('/api/history/', {'search': 'sqr', 'order': order})).json()
+            self.assertEqual([row['expression'] for row in page['history']], ['sqrt(9)'])
+
+    async def test_memory(self):
+        await self.post('/api/memory/', {'action': 'store', 'value': 2})
+        response = await self.post('/api/memory/', {'action': 'add', 'value': 3.5})
+        self.assertEqual(response.json(), {'success': True, 'memory_value': 5.5})
+        self.assertEqual((await self.post('/api/memory/', {'action': 'recall'})).json(), {'value': 5.5})
+        response = await self.post('/api/memory/', {'action': 'add', 'value': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(
+    KCALC_EVALUATION_SANDBOX=True,
+    KCALC_SANDBOX_WORKERS=1,
+    KCALC_SANDBOX_TIMEOUT=10.0,
+    KCALC_SANDBOX_TIMEOUTS={'scientific': 0.2},
+    KCALC_SANDBOX_MEMORY_LIMIT=512 * 1024 * 1024,
+)
+class SandboxTests(TestCase):
+    def setUp(self):
+        # A pool started by an earlier test would keep that test's settings
+        shutdown_pool()
+        self.addCleanup(shutdown_pool)
+
+    def calculate(self, data):
+        response = self.client.post('/api/calculate/', json.dumps(data), content_type='application/json')
+        return response.json()
+
+    def test_runaway_expression_times_out_and_the_pool_recovers(self):
+        runaway = '+'.join(['factorial(5000)'] * 2000)
+        result = self.calculate({'expression': runaway, 'type': 'scientific'})
+        self.assertEqual(result['error'], 'Calculation timed out after 0.2 seconds')
+        self.assertEqual(self.calculate({'expression': '2+3', 'type': 'scientific'})['result'], '5')
+        stats = sandbox_stats()
+        self.assertEqual((stats['timeouts'], stats['restarts'], stats['workers']), (1, 1, 1))
+
+    def test_memory_limit(self):
+        # The Krylov basis alone would take 202 rows of 10**6 floats, 1.5 GiB
+        result = self.calculate({'type': 'matrix', 'action': 'eigenvalues', 'k': 100, 'matrix_data': {
+            'format': 'coo', 'shape': [10 ** 6, 10 ** 6], 'row': [0], 'col': [0], 'data': [1.0],
+        }})
+        self.assertIn('Unable to allocate', result['error'])
+        # The worker survives a MemoryError
+        self.assertEqual(self.calculate({'expression': '2+3'})['result'], '5')
+        self.assertEqual(sandbox_stats()['restarts'], 0)
+
+
+# In-process evaluation, whatever the environment: starting a sandbox worker takes longer than the deadlines here
+@override_settings(KCALC_EVALUATION_SANDBOX=False)
+class BatchTests(TestCase):
+    def batch(self, items):
+        response = self.client.post('/api/calculate/batch/', json.dumps({'items': items}),
+                                    content_type='application/json')
+        return response.json()
+
+    def test_items_succeed_or_fail_in_place(self):
+        results = self.batch([{'expression': '2+3'}, {'expression': '1/0'}, 'x', {'expression': 'sqrt(16)'}])['results']
+        self.assertEqual([item['success'] for item in results], [True, False, False, True])
+        self.assertEqual([results[0]['result'], results[3]['result']], ['5', '4'])
+
+    @override_settings(KCALC_BATCH_TIMEOUT=0.1)
+    def test_items_after_the_deadline_fail(self):
+        slow = {'type': 'matrix', 'action': 'rank', 'matrix_data': banded(1500, -1, 2, -1)}
+        results = self.batch([slow, {'expression': '1+1'}, {'expression': '2+2'}])['results']
+        self.assertEqual(results[0]['result'], '1500')
+        for result in results[1:]:
+            self.assertFalse(result['success'])
+            self.assertEqual(result['error'], 'Batch time limit of 0.1 seconds exceeded')
+
+
+class SparseMatrixTests(TestCase):
+    # Above the size where eigenvalues are computed densely, so the Krylov iteration runs
+    N = 2000
+
+    def calculate(self, matrix_data, action, **options):
+        response = self.client.post('/api/calculate/', json.dumps({
+            'type': 'matrix', 'action': action, 'matrix_data': matrix_data, **options
+        }), content_type='application/json')
+        return response.json()
+
+    def tridiagonal_eigenvalues(self, diagonal, off_diagonal):
+        j = np.arange(1, self.N + 1)
+        return np.sort(diagonal + 2 * off_diagonal * np.cos(j * np.pi / (self.N + 1)))
+
+    def assert_eigenvalues(self, result, expected):
+        self.assertTrue(result['success'], result.get('error'))
+        np.testing.assert_allclose(sorted(result['result']['real']), sorted(expected), atol=1e-9)
+        self.assertEqual(result['result']['imag'], [0.0] * len(expected))
+
+    def test_smallest_eigenvalues_of_clustered_band(self):
+        expected = self.tridiagonal_eigenvalues(2, -1)
+        result = self.calculate(banded(self.N, -1, 2, -1), 'eigenvalues', k=6, which='SR')
+        self.assert_eigenvalues(result, expected[:6])
+
+    def test_largest_eigenvalues_of_band(self):
+        expected = self.tridiagonal_eigenvalues(4, 1)
+        for which in ('LM', 'LR'):
+            result = self.calculate(banded(self.N, 1, 4, 1), 'eigenvalues', k=4, which=which)
+            self.assert_eigenvalues(result, expected[-4:])
+
+    def test_nonsymmetric_eigenvalues(self):
+        rng = np.random.default_rng(0)
+        row, col = rng.integers(0, self.N, (2, 5 * self.N))
+        data = rng.standard_normal(5 * self.N)
+        dense = np.zeros((self.N, self.N))
+        np.add.at(dense, (row, col), data)
+        values = np.linalg.eigvals(dense)
+        expected = values[np.argsort(-np.abs(values))][:6]
+
+        result = self.calculate(
+            {'format': 'coo', 'shape': [self.N, self.N], 'row': row.tolist(), 'col': col.tolist(), 'data': data.tolist()},
+            'eigenvalues', k=6
+        )
+        self.assertTrue(result['success'], result.get('error'))
+        found = np.array(result['result']['real']) + 1j * np.array(result['result']['imag'])
+        np.testing.assert_allclose(np.sort_complex(found), np.sort_complex(expected), atol=1e-8)
+
+    def test_repeated_eigenvalues_are_all_found(self):
+        identity = {'format': 'coo', 'shape': [self.N, self.N], 'row': list(range(self.N)),
+                    'col': list(range(self.N)), 'data': [1.0] * self.N}
+        result = self.calculate(identity, 'eigenvalues', k=6)
+        self.assert_eigenvalues(result, [1.0] * 6)
+
+    def test_eigenvalue_count_is_validated(self):
+        result = self.calculate(banded(10, -1, 2, -1), 'eigenvalues', k=11)
+        self.assertFalse(result['success'])
+        self.assertIn('k must be a whole number from 1 to 10', result['error'])
+
+    def test_rank_of_band(self):
+        self.assertEqual(self.calculate(banded(self.N, -1, 2, -1), 'rank')['result'], str(self.N))
+        # The graph Laplacian of a path: every row sums to zero
+        laplacian = banded(self.N, -1, 2, -1)
+        laplacian['data'][0] = laplacian['data'][self.N - 1] = 1
+        self.assertEqual(self.calculate(laplacian, 'rank')['result'], str(self.N - 1))
+
+    def test_rank_of_nonsymmetric_band(self):
+        upper = banded(self.N, 0, 1, 1)
+        upper['data'][5] = 0
+        self.assertEqual(self.calculate(upper, 'rank')['result'], str(self.N - 1))
+
+    def test_solve_band(self):
+        x = np.arange(self.N, dtype=float)
+        b = 4 * x + np.roll(x, 1) + np.roll(x, -1)
+        b[0] -= x[-1]
+        b[-1] -= x[0]
+        result = self.calculate(banded(self.N, 1, 4, 1), 'solve', b=b.tolist())
+        self.assertTrue(result['success'], result.get('error'))
+        np.testing.assert_allclose(np.array(result['result'], dtype=float), x, atol=1e-8)
+
+    def test_trace_of_large_declared_shape(self):
+        n = 10 ** 6
+        result = self.calculate({'format': 'coo', 'shape': [n, n], 'row': [0, 5, 7], 'col': [0, 5, 3],
+                                 'data': [1.5, 2, 9]}, 'trace')
+        self.assertEqual(result['result'], '3.5')
+
+    def test_shape_is_bounded(self):
+        n = 2 ** 33
+        result = self.calculate({'format': 'coo', 'shape': [n, n], 'row': [0], 'col': [0], 'data': [1]}, 'trace')
+        self.assertFalse(result['success'])
+        self.assertIn('dimensions can be at most', result['error'])
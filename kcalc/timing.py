@@ -0,0 +1,229 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import nullcontext
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+# The RequestTiming of the request being handled, None outside of a timed request
+_current = contextvars.ContextVar('kcalc_timing', default=None)
+
+_null_span = nullcontext()
+
+
+def timing_enabled():
+    return getattr(settings, 'KCALC_TIMING', False)
+
+
+class Span:
+    def __init__(self, record, name):
+        self.record = record
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.record.add(self.name, time.perf_counter() - self.start)
+
+
+class RequestTiming:
+    """Per-stage durations, in seconds, and database query counts for one request"""
+
+    def __init__(self):
+        self.stages = {}
+        self.queries = 0
+        self.calc_type = ''
+        self.action = ''
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def query_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.add('db', time.perf_counter() - start)
+
+    def server_timing(self, total):
+        entries = [f'total;dur={total * 1000:.3f}']
+        for name, seconds in self.stages.items():
+            entry = f'{name};dur={seconds * 1000:.3f}'
+            if name == 'db':
+                entry += f';desc="{self.queries} queries"'
+            entries.append(entry)
+        return ', '.join(entries)
+
+
+def span(name):
+    """Context manager timing a stage of the current request, a no-op when it is not timed"""
+    record = _current.get()
+    if record is None:
+        return _null_span
+    return Span(record, name)
+
+
+def tag(calc_type, action):
+    """Label the current request for aggregation, e.g. with the calculation type and action"""
+    record = _current.get()
+    if record is not None:
+        record.calc_type = str(calc_type)
+        record.action = str(action)
+
+
+def recording():
+    """Collect spans into a fresh RequestTiming from here on, e.g. in a sandbox worker"""
+    record = RequestTiming()
+    _current.set(record)
+    return record
+
+
+def merge(stages):
+    """Add stages timed elsewhere, such as in a sandbox worker, to the current request"""
+    record = _current.get()
+    if record is not None:
+        for name, seconds in stages.items():
+            record.add(name, seconds)
+
+
+def query_wrapper(execute, sql, params, many, context):
+    """Database execute wrapper counting queries for the current request"""
+    record = _current.get()
+    if record is None:
+        return execute(sql, params, many, context)
+    return record.query_wrapper(execute, sql, params, many, context)
+
+
+def install_query_wrapper(sender, connection, **kwargs):
+    """connection_created receiver installing query_wrapper on every new connection"""
+    if query_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_wrapper)
+
+
+class Histogram:
+    """Counts of durations in logarithmic buckets, 10 per decade from 10 microseconds to 100 seconds"""
+
+    BOUNDS = [10 ** (exponent / 10) for exponent in range(-50, 21)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of samples, at most the maximum seen"""
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(self.BOUNDS[index], self.max) if index < len(self.BOUNDS) else self.max
+        return self.max
+
+
+class TimingStats:
+    """Request durations aggregated by endpoint, calculation type and action in this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def record(self, endpoint, record, total, failed=False):
+        key = (endpoint, record.calc_type, record.action)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = {'histogram': Histogram(), 'stages': {}, 'queries': 0, 'errors': 0}
+            entry['histogram'].add(total)
+            entry['queries'] += record.queries
+            entry['errors'] += failed
+            for name, seconds in record.stages.items():
+                entry['stages'][name] = entry['stages'].get(name, 0.0) + seconds
+
+    def as_list(self):
+        with self._lock:
+            rows = []
+            for (endpoint, calc_type, action), entry in sorted(self._entries.items()):
+                histogram = entry['histogram']
+                rows.append({
+                    'endpoint': endpoint,
+                    'calc_type': calc_type,
+                    'action': action,
+                    'count': histogram.count,
+                    'errors': entry['errors'],
+                    'mean_ms': histogram.total * 1000 / histogram.count,
+                    'p50_ms': histogram.percentile(0.50) * 1000,
+                    'p95_ms': histogram.percentile(0.95) * 1000,
+                    'p99_ms': histogram.percentile(0.99) * 1000,
+                    'max_ms': histogram.max * 1000,
+                    'mean_queries': entry['queries'] / histogram.count,
+                    'mean_stage_ms': {
+                        name: seconds * 1000 / histogram.count for name, seconds in entry['stages'].items()
+                    },
+                })
+            return rows
+
+    def reset(self):
+        with self._lock:
+            self._entries = {}
+
+
+stats = TimingStats()
+
+
+class TimingMiddleware:
+    """Time each request and its stages, report them in a Server-Timing header and aggregate them
+
+    Removed from the middleware chain unless KCALC_TIMING is set, so that
+    disabled timing costs only a context variable lookup per span.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not timing_enabled():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        record = RequestTiming()
+        token = _current.set(record)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, record, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        record = RequestTiming()
+        token = _current.set(record)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, record, time.perf_counter() - start)
+
+    def finish(self, request, response, record, total):
+        match = request.resolver_match
+        stats.record(match.view_name if match else 'unresolved', record, total, response.status_code >= 400)
+        response['Server-Timing'] = record.server_timing(total)
+        return response
@@ -1,14 +1,30 @@
+from django.conf import settings
 from django.urls import path
 
 from . import views
 
 app_name = 'calculator'
 
+# Under ASGI, native async views avoid a thread hop per request
+if getattr(settings, 'KCALC_ASYNC_VIEWS', False):
+    calculate_api = views.acalculate_api
+    preferences_api = views.apreferences_api
+    history_api = views.ahistory_api
+    memory_api = views.amemory_api
+else:
+    calculate_api = views.calculate_api
+    preferences_api = views.preferences_api
+    history_api = views.history_api
+    memory_api = views.memory_api
+
 urlpatterns = [
     path('', views.calculator_view, name='calculator'),
-    path('api/calculate/', views.calculate_api, name='calculate_api'),
-    path('api/preferences/', views.preferences_api, name='preferences_api'),
-    path('api/history/', views.history_api, name='history_api'),
+    path('api/calculate/', calculate_api, name='calculate_api'),
+    path('api/calculate/batch/', views.calculate_batch_api, name='calculate_batch_api'),
+    path('api/preferences/', preferences_api, name='preferences_api'),
+    path('api/history/', history_api, name='history_api'),
     path('api/clear-history/', views.clear_history_api, name='clear_history_api'),
-    path('api/memory/', views.memory_api, name='memory_api'),
+    path('api/memory/', memory_api, name='memory_api'),
+    path('api/export-history/', views.export_history_api, name='export_history_api'),
+    path('api/timing/', views.timing_api, name='timing_api'),
 ]
@@ -1,19 +1,87 @@
+import asyncio
+import contextvars
 import csv
+import io
 import json
 import math
 import operator
-import re
-from decimal import Decimal, getcontext
+import time
+import zlib
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from decimal import Decimal, localcontext
 
 import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
 from django.core.paginator import Paginator
-from django.db.models import Q
+from django.db.models import F, Q, Value
 from django.http import HttpResponse
 from django.http import JsonResponse
+from django.http import StreamingHttpResponse
 from django.shortcuts import render
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from django.views.decorators.csrf import csrf_exempt
 
+from .expressions import (
+    CompiledExpression,
+    ExpressionCache,
+    check_expression_cost,
+    compile_expression,
+    normalize_expression,
+    parse_expression,
+)
+from .history import aflush_history, arecord_history, flush_history, record_history
+from .history import writer as history_writer
+from .matrices import (
+    MATRIX_ENCODINGS,
+    count_cells,
+    describe_cells,
+    describe_encoded,
+    determinant,
+    eigenvalues,
+    eigh,
+    encode_result,
+    format_cells,
+    format_eigen,
+    format_stack,
+    inverse,
+    lu,
+    parse_matrix,
+    parse_vector,
+    qr,
+    require_square,
+    solve,
+    stack_calculation,
+    svd,
+)
 from .models import CalculationHistory, UserPreferences
+from .precision import (
+    DECIMAL_DEGREE_FUNCTIONS,
+    DECIMAL_FUNCTIONS,
+    DECIMAL_OPERATORS,
+    decimal_constants,
+    decimal_literal,
+    working_precision,
+)
+from .preferences import (
+    acache_preferences,
+    aget_preferences,
+    ainvalidate_preferences,
+    cache_preferences,
+    get_preferences,
+    invalidate_preferences,
+)
+from .preferences import stats as preferences_cache_stats
+from .sampling import adaptive_sample, decimate_minmax, uniform_sample
+from .sandbox import evaluation_pool, sandbox_stats
+from .search import ranked_history_ids, search_history
+from .sparse import is_sparse, sparse_calculation
+from .timing import span, tag, timing_enabled
+from .timing import stats as timing_stats
 
 
 # Add these views to your existing views.py file
@@ -21,33 +89,113 @@ from .models import CalculationHistory, UserPreferences
 
 @csrf_exempt
 def export_history_api(request):
-    """Export calculation history as CSV"""
+    """Export calculation history as CSV
+
+    Rows are streamed straight from the database. Optional query parameters:
+    start and end (ISO dates or datetimes, end dates are inclusive), type
+    (calculation type) and gzip=1 for a compressed download.
+    """
     if request.method != 'GET':
         return JsonResponse({'error': 'GET method required'}, status=405)
 
     user, session_key = get_user_session(request)
+    flush_history()
 
     if user:
         history = CalculationHistory.objects.filter(user=user)
     else:
         history = CalculationHistory.objects.filter(session_key=session_key)
 
-    # Create CSV response
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="calculator_history.csv"'
+    try:
+        start = parse_export_bound(request.GET.get('start'))
+        end = parse_export_bound(request.GET.get('end'), end=True)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    if start:
+        history = history.filter(timestamp__gte=start)
+    if end:
+        history = history.filter(timestamp__lt=end)
+
+    calc_type = request.GET.get('type')
+    if calc_type:
+        history = history.filter(calculation_type=calc_type)
+
+    chunk_size = getattr(settings, 'KCALC_EXPORT_CHUNK_SIZE', 2000)
+    rows = history.order_by('-timestamp').values_list(
+        'expression', 'result', 'calculation_type', 'timestamp'
+    ).iterator(chunk_size=chunk_size)
+    content = stream_history_csv(rows, chunk_size)
+    filename = 'calculator_history.csv'
+    content_type = 'text/csv'
+    if request.GET.get('gzip') in ('1', 'true'):
+        content = gzip_stream(content)
+        filename += '.gz'
+        content_type = 'application/gzip'
+
+    if isinstance(request, ASGIRequest):
+        # Django buffers a sync streaming body whole under ASGI
+        content = aiterate(content)
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+
+    return response
+
+
+def parse_export_bound(value, end=False):
+    """Parse a start/end export filter into an aware datetime, None if not given
+
+    A bare end date covers that whole day, so it is moved to the next midnight.
+    """
+    if not value:
+        return None
+
+    # Checked first: parse_datetime also accepts a bare date, as midnight
+    day = parse_date(value)
+    if day is not None:
+        bound = datetime.combine(day + timedelta(days=1) if end else day, datetime.min.time())
+    else:
+        bound = parse_datetime(value)
+        if bound is None:
+            raise ValueError(f"Invalid date: {value}")
 
-    writer = csv.writer(response)
+    if timezone.is_naive(bound):
+        bound = timezone.make_aware(bound)
+    return bound
+
+
+def stream_history_csv(rows, chunk_size):
+    """Yield CSV text for history rows, one chunk per chunk_size rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
     writer.writerow(['Expression', 'Result', 'Type', 'Date'])
 
-    for calc in history.order_by('-timestamp'):
-        writer.writerow([
-            calc.expression,
-            calc.result,
-            calc.calculation_type,
-            calc.timestamp.strftime('%Y-%m-%d %H:%M:%S')
-        ])
+    for count, (expression, result, calc_type, timestamp) in enumerate(rows, 1):
+        writer.writerow([expression, result, calc_type, timestamp.strftime('%Y-%m-%d %H:%M:%S')])
+        if count % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
 
-    return response
+
+async def aiterate(iterator):
+    """Async iterator over a sync one, advancing it in a thread so that database reads never block"""
+    done = object()
+    advance = sync_to_async(next)
+    while (item := await advance(iterator, done)) is not done:
+        yield item
+
+
+def gzip_stream(chunks):
+    """Compress a stream of text chunks into gzip bytes"""
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
 
 
 @csrf_exempt
@@ -58,16 +206,7 @@ def export_settings_api(request):
 
     user, session_key = get_user_session(request)
 
-    prefs, created = UserPreferences.objects.get_or_create(
-        user=user,
-        session_key=session_key,
-        defaults={
-            'theme': 'dark',
-            'decimal_places': 10,
-            'angle_unit': 'rad',
-            'memory_value': 0
-        }
-    )
+    prefs = get_preferences(user, session_key)
 
     settings_data = {
         'theme': prefs.theme,
@@ -109,17 +248,12 @@ def import_settings_api(request):
             session_key=session_key
         )
 
-        # Update preferences from imported data
-        if 'theme' in settings_data:
-            prefs.theme = settings_data['theme']
-        if 'decimal_places' in settings_data:
-            prefs.decimal_places = int(settings_data['decimal_places'])
-        if 'angle_unit' in settings_data:
-            prefs.angle_unit = settings_data['angle_unit']
-        if 'memory_value' in settings_data:
-            prefs.memory_value = Decimal(str(settings_data['memory_value']))
-
-        prefs.save()
+        # Update preferences from imported data, writing only the fields it has as preferences_api does
+        fields = update_preferences(prefs, settings_data)
+        prefs.save(update_fields=fields)
+        if 'memory_value' not in fields:
+            prefs.refresh_from_db(fields=['memory_value'])
+        cache_preferences(prefs)
 
         return JsonResponse({
             'success': True,
@@ -132,8 +266,8 @@ def import_settings_api(request):
         return JsonResponse({'error': f'Import failed: {str(e)}'}, status=400)
 
 
-# Set high precision for calculations
-getcontext().prec = 50
+# Compiled expressions shared across requests, keyed on (expression, angle_unit)
+expression_cache = ExpressionCache(getattr(settings, 'KCALC_EXPRESSION_CACHE_SIZE', 1024))
 
 
 class AdvancedCalculator:
@@ -171,6 +305,8 @@ class AdvancedCalculator:
         'factorial': math.factorial,
         'degrees': math.degrees,
         'radians': math.radians,
+        'min': min,
+        'max': max,
     }
 
     CONSTANTS = {
@@ -182,93 +318,104 @@ class AdvancedCalculator:
     def __init__(self, angle_unit='rad'):
         self.angle_unit = angle_unit
         self.memory = 0
+        self.functions = DEGREE_FUNCTIONS if angle_unit == 'deg' else self.FUNCTIONS
+
+    def compile(self, expression):
+        """Parse and validate a normalized expression into a callable"""
+        tree = parse_expression(expression)
+        limit_expression_cost(tree)
+        return compile_expression(tree, self.OPERATORS, self.functions, self.CONSTANTS)
 
-    def evaluate(self, expression):
-        """Safely evaluate mathematical expressions"""
+    def evaluate(self, expression, decimal_places=None):
+        """Safely evaluate mathematical expressions
+
+        Results are floats unless showing them with decimal_places digits
+        needs more precision than a float has; those are recomputed with
+        Decimal arithmetic at a matching precision.
+        """
         try:
             # Clean the expression
-            expression = expression.replace('×', '*').replace('÷', '/').strip()
+            expression = normalize_expression(expression)
 
             # Handle empty expression
             if not expression:
                 return 0
 
-            # Replace constants
-            for const, value in self.CONSTANTS.items():
-                expression = expression.replace(const, str(value))
-
-            # Handle angle conversions for trigonometric functions
-            if self.angle_unit == 'deg':
-                # Convert degrees to radians for trig functions
-                trig_patterns = [
-                    (r'sin\(([^)]+)\)', lambda m: f'sin(({m.group(1)}*math.pi/180))'),
-                    (r'cos\(([^)]+)\)', lambda m: f'cos(({m.group(1)}*math.pi/180))'),
-                    (r'tan\(([^)]+)\)', lambda m: f'tan(({m.group(1)}*math.pi/180))'),
-                    (r'asin\(([^)]+)\)', lambda m: f'(asin({m.group(1)})*180/math.pi)'),
-                    (r'acos\(([^)]+)\)', lambda m: f'(acos({m.group(1)})*180/math.pi)'),
-                    (r'atan\(([^)]+)\)', lambda m: f'(atan({m.group(1)})*180/math.pi)'),
-                ]
-
-                for pattern, replacement in trig_patterns:
-                    expression = re.sub(pattern, replacement, expression)
-
-            # Replace ^ with **
-            expression = expression.replace('^', '**')
-
-            # Replace function names with math module equivalents
-            function_replacements = {
-                'sin': 'math.sin',
-                'cos': 'math.cos',
-                'tan': 'math.tan',
-                'asin': 'math.asin',
-                'acos': 'math.acos',
-                'atan': 'math.atan',
-                'sinh': 'math.sinh',
-                'cosh': 'math.cosh',
-                'tanh': 'math.tanh',
-                'log': 'math.log10',
-                'ln': 'math.log',
-                'sqrt': 'math.sqrt',
-                'exp': 'math.exp',
-                'ceil': 'math.ceil',
-                'floor': 'math.floor',
-                'factorial': 'math.factorial',
-                'degrees': 'math.degrees',
-                'radians': 'math.radians',
-            }
-
-            for func, math_func in function_replacements.items():
-                expression = re.sub(r'\b' + func + r'\b', math_func, expression)
-
-            # Safely evaluate using a restricted environment
-            safe_dict = {
-                'math': math,
-                'abs': abs,
-                'round': round,
-                'min': min,
-                'max': max,
-                'sum': sum,
-                'pi': math.pi,
-                'e': math.e,
-                'tau': math.tau,
-            }
+            key = (expression, self.angle_unit)
+            compiled = expression_cache.get(key)
+            if compiled is None:
+                compiled = CompiledExpression(self.compile(expression))
+                expression_cache.set(key, compiled)
 
-            # Evaluate the expression
-            result = eval(expression, {"__builtins__": {}}, safe_dict)
+            result = compiled()
 
             # Handle special cases
             if result == math.inf:
                 return 'Infinity'
             elif result == -math.inf:
                 return '-Infinity'
-            elif math.isnan(result):
+            elif not isinstance(result, int) and math.isnan(result):
                 return 'NaN'
 
+            if decimal_places is not None:
+                precision = working_precision(result, decimal_places)
+                if precision is not None and precision <= getattr(settings, 'KCALC_MAX_PRECISION', 1000):
+                    precise = self.evaluate_decimal(expression, precision)
+                    if precise is not None:
+                        return precise
+
             return float(result)
 
         except Exception as e:
             raise ValueError(f"Calculation error: {str(e)}")
 
+    def evaluate_decimal(self, expression, precision):
+        """Evaluate a normalized expression with Decimal arithmetic, or None where that fails"""
+        try:
+            with localcontext() as ctx:
+                ctx.prec = precision
+
+                # Constants, and so the memoized result, hold for one precision only
+                key = (expression, self.angle_unit, precision)
+                compiled = expression_cache.get(key)
+                if compiled is None:
+                    tree = parse_expression(expression)
+                    limit_expression_cost(tree)
+                    functions = DECIMAL_DEGREE_FUNCTIONS if self.angle_unit == 'deg' else DECIMAL_FUNCTIONS
+                    compiled = CompiledExpression(compile_expression(
+                        tree, DECIMAL_OPERATORS, functions, decimal_constants(), literal=decimal_literal
+                    ))
+                    expression_cache.set(key, compiled)
+
+                result = +Decimal(compiled())
+        except (ArithmeticError, ValueError, TypeError):
+            # e.g. approximated sub-expressions, which are floats
+            return None
+
+        return result if result.is_finite() else None
+
+
+def limit_expression_cost(tree):
+    """Refuse, or approximate, the parts of a parsed expression too costly to compute exactly"""
+    check_expression_cost(
+        tree,
+        max_bits=getattr(settings, 'KCALC_MAX_RESULT_BITS', 100000),
+        max_depth=getattr(settings, 'KCALC_MAX_EXPRESSION_DEPTH', 200),
+        approximate=getattr(settings, 'KCALC_EXPENSIVE_EXPRESSIONS', 'refuse') == 'approximate'
+    )
+
+
+# In degree mode trig functions take degrees and inverse trig functions return degrees
+DEGREE_FUNCTIONS = {
+    **AdvancedCalculator.FUNCTIONS,
+    'sin': lambda x: math.sin(math.radians(x)),
+    'cos': lambda x: math.cos(math.radians(x)),
+    'tan': lambda x: math.tan(math.radians(x)),
+    'asin': lambda x: math.degrees(math.asin(x)),
+    'acos': lambda x: math.degrees(math.acos(x)),
+    'atan': lambda x: math.degrees(math.atan(x)),
+}
+
 
 def get_user_session(request):
     """Get user or session key for preferences"""
@@ -286,18 +433,10 @@ def calculator_view(request):
     user, session_key = get_user_session(request)
 
     # Get user preferences
-    prefs, created = UserPreferences.objects.get_or_create(
-        user=user,
-        session_key=session_key,
-        defaults={
-            'theme': 'dark',
-            'decimal_places': 10,
-            'angle_unit': 'rad',
-            'memory_value': 0
-        }
-    )
+    prefs = get_preferences(user, session_key)
 
     # Get recent history for sidebar
+    flush_history()
     if user:
         recent_history = CalculationHistory.objects.filter(user=user).order_by('-timestamp')[:5]
     else:
@@ -312,6 +451,79 @@ def calculator_view(request):
     return render(request, 'calculator/calculator.html', context)
 
 
+# Actions that are not recorded in the calculation history
+MEMORY_ACTIONS = ['memory_store', 'memory_recall', 'memory_clear', 'memory_add', 'memory_subtract']
+
+
+def history_result(formatted_result):
+    """Text recorded in the history for a calculation result"""
+    if isinstance(formatted_result, dict) and 'errors' in formatted_result:
+        # Matrix stacks can hold thousands of results
+        errors = formatted_result['errors']
+        failed = sum(error is not None for error in errors)
+        return f"{len(errors)} matrices, {failed} failed" if failed else f"{len(errors)} matrices"
+    if isinstance(formatted_result, dict) and any(
+        isinstance(value, dict) and 'encoding' in value for value in [formatted_result, *formatted_result.values()]
+    ):
+        # Binary matrices can run to megabytes, record only what was computed
+        return describe_encoded(formatted_result)
+    if isinstance(formatted_result, dict) and formatted_result.get('type') == 'graph_data':
+        # Plots hold up to KCALC_GRAPH_MAX_POINTS points per function, record only their size
+        functions = len(formatted_result.get('series', [None]))
+        return f"{functions} function{'s' if functions != 1 else ''}, {len(formatted_result['x_values'])} points"
+    if isinstance(formatted_result, (list, dict)):
+        if count_cells(formatted_result) > getattr(settings, 'KCALC_HISTORY_MAX_CELLS', 100):
+            # Large JSON matrices are recorded by shape too, whatever the transport
+            return describe_cells(formatted_result)
+    return str(formatted_result)
+
+
+def perform_calculation(data, calculator, decimal_places):
+    """Run one calculation request and return its recorded expression and formatted result"""
+    expression = data.get('expression', '')
+    calc_type = data.get('type', 'basic')
+    action = data.get('action', 'calculate')
+    matrix_data = data.get('matrix_data', None)
+
+    # Handle different calculation types
+    if calc_type == 'matrix':
+        with span('matrix'):
+            result = handle_matrix_calculation(matrix_data, action, expression, data)
+        response_format = data.get('response_format', 'json')
+        if response_format != 'json':
+            if response_format not in MATRIX_ENCODINGS:
+                raise ValueError(f"response_format must be json or one of: {', '.join(MATRIX_ENCODINGS)}")
+            if isinstance(result, (np.ndarray, dict)):
+                # Binary results skip per-cell formatting entirely
+                with span('format'):
+                    return expression, encode_result(result, response_format)
+    elif calc_type == 'graph':
+        if not expression and isinstance(data.get('functions'), list):
+            # Multi-function plots are recorded as a single history entry
+            expression = '; '.join(str(func) for func in data['functions'])
+        with span('graph'):
+            result = handle_graph_calculation(expression, action, data)
+    else:
+        # Basic and scientific calculations
+        with span('evaluate'):
+            result = calculator.evaluate(expression, decimal_places)
+
+    # Format result
+    with span('format'):
+        return expression, format_result(result, decimal_places, calc_type)
+
+
+def run_calculation(data, angle_unit, decimal_places, timeout=None):
+    """Run perform_calculation, in the evaluation sandbox when KCALC_EVALUATION_SANDBOX is set
+
+    timeout further limits the sandbox timeout; calculations run in process cannot be interrupted.
+    """
+    if getattr(settings, 'KCALC_EVALUATION_SANDBOX', False):
+        with span('sandbox'):
+            return evaluation_pool().run(data, angle_unit, decimal_places, timeout)
+    return perform_calculation(data, AdvancedCalculator(angle_unit=angle_unit), decimal_places)
+
+
 @csrf_exempt
 def calculate_api(request):
     """API endpoint for calculations"""
@@ -319,48 +531,105 @@ def calculate_api(request):
         return JsonResponse({'error': 'POST method required'}, status=405)
 
     try:
-        data = json.loads(request.body)
-        expression = data.get('expression', '')
+        with span('parse'):
+            data = json.loads(request.body)
         calc_type = data.get('type', 'basic')
         action = data.get('action', 'calculate')
-        matrix_data = data.get('matrix_data', None)
+        tag(calc_type, action)
 
         user, session_key = get_user_session(request)
-        prefs, _ = UserPreferences.objects.get_or_create(
-            user=user,
-            session_key=session_key,
-            defaults={'angle_unit': 'rad', 'decimal_places': 10}
-        )
+        prefs = get_preferences(user, session_key)
 
-        calculator = AdvancedCalculator(angle_unit=prefs.angle_unit)
-
-        # Handle different calculation types
-        if calc_type == 'matrix':
-            result = handle_matrix_calculation(matrix_data, action, expression)
-        elif calc_type == 'graph':
-            result = handle_graph_calculation(expression, action)
-        else:
-            # Basic and scientific calculations
-            result = calculator.evaluate(expression)
-
-        # Format result
-        formatted_result = format_result(result, prefs.decimal_places, calc_type)
+        expression, formatted_result = run_calculation(data, prefs.angle_unit, prefs.decimal_places)
 
         # Save to history if it's a calculation (not a memory operation, etc.)
-        if action not in ['memory_store', 'memory_recall', 'memory_clear', 'memory_add', 'memory_subtract']:
-            CalculationHistory.objects.create(
+        if action not in MEMORY_ACTIONS:
+            record_history([CalculationHistory(
                 user=user,
                 session_key=session_key,
                 expression=expression,
-                result=str(formatted_result),
+                result=history_result(formatted_result),
                 calculation_type=calc_type
-            )
+            )])
 
+        with span('encode'):
+            return JsonResponse({
+                'result': formatted_result,
+                'expression': expression,
+                'success': True
+            })
+
+    except Exception as e:
         return JsonResponse({
-            'result': formatted_result,
-            'expression': expression,
-            'success': True
-        })
+            'error': str(e),
+            'success': False
+        }, status=400)
+
+
+@csrf_exempt
+def calculate_batch_api(request):
+    """API endpoint for running many calculations in one request"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST method required'}, status=405)
+
+    try:
+        with span('parse'):
+            data = json.loads(request.body)
+        items = data.get('items') if isinstance(data, dict) else data
+
+        if not isinstance(items, list):
+            raise ValueError("items must be a list of calculations")
+
+        max_items = getattr(settings, 'KCALC_BATCH_MAX_ITEMS', 1000)
+        if len(items) > max_items:
+            raise ValueError(f"A batch can hold at most {max_items} calculations")
+
+        user, session_key = get_user_session(request)
+        prefs = get_preferences(user, session_key)
+
+        # Items still waiting once the batch has used up its time fail in place
+        batch_timeout = getattr(settings, 'KCALC_BATCH_TIMEOUT', 30.0)
+        deadline = time.monotonic() + batch_timeout
+
+        results = []
+        history = []
+        for item in items:
+            # A failing item is reported in place and does not abort the batch
+            try:
+                if not isinstance(item, dict):
+                    raise ValueError("Each calculation must be an object")
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise ValueError(f"Batch time limit of {batch_timeout:g} seconds exceeded")
+                expression, formatted_result = run_calculation(
+                    item, prefs.angle_unit, prefs.decimal_places, timeout=remaining
+                )
+            except Exception as e:
+                results.append({'error': str(e), 'success': False})
+                continue
+
+            results.append({
+                'result': formatted_result,
+                'expression': expression,
+                'success': True
+            })
+
+            if item.get('action', 'calculate') not in MEMORY_ACTIONS:
+                history.append(CalculationHistory(
+                    user=user,
+                    session_key=session_key,
+                    expression=expression,
+                    result=history_result(formatted_result),
+                    calculation_type=item.get('type', 'basic')
+                ))
+
+        record_history(history)
+
+        with span('encode'):
+            return JsonResponse({
+                'results': results,
+                'success': True
+            })
 
     except Exception as e:
         return JsonResponse({
@@ -377,11 +646,30 @@ def format_result(result, decimal_places, calc_type='basic'):
     if calc_type == 'matrix' and isinstance(result, (list, np.ndarray)):
         return format_matrix_result(result, decimal_places)
 
+    if calc_type == 'matrix' and isinstance(result, dict) and 'errors' in result:
+        return format_stack(result, decimal_places)
+
+    if calc_type == 'matrix' and isinstance(result, dict) and 'imag' in result:
+        return format_eigen(result, decimal_places)
+
+    if calc_type == 'matrix' and isinstance(result, dict):
+        # Decompositions: one formatted array per factor
+        return {key: format_matrix_result(value, decimal_places) for key, value in result.items()}
+
     if calc_type == 'graph' and isinstance(result, dict):
         return result
 
+    if isinstance(result, Decimal):
+        # Decimal results were computed to at least decimal_places digits
+        formatted = f"{result:.{decimal_places}f}"
+        formatted = formatted.rstrip('0').rstrip('.') if '.' in formatted else formatted
+        return '0' if formatted == '-0' else formatted
+
     try:
         result_float = float(result)
+        if isinstance(result, str) and not math.isfinite(result_float):
+            # Already formatted beyond the float range, e.g. a determinant of 1.5e+400
+            return result
         if result_float.is_integer():
             return str(int(result_float))
         else:
@@ -398,6 +686,8 @@ def format_matrix_result(matrix, decimal_places):
         return format_result(matrix, decimal_places)
 
     if isinstance(matrix, np.ndarray):
+        if matrix.dtype.kind in 'biuf' and matrix.ndim in (1, 2):
+            return format_cells(matrix, decimal_places)
         matrix = matrix.tolist()
 
     # Format each element in the matrix
@@ -412,63 +702,57 @@ def format_matrix_result(matrix, decimal_places):
     return str(matrix)
 
 
-def handle_matrix_calculation(matrix_data, action, expression=''):
+def handle_matrix_calculation(matrix_data, action, expression='', options=None):
     """Handle matrix operations"""
     try:
         if matrix_data is None:
             # Create a default 3x3 identity matrix if no data provided
             matrix_data = [[1, 0, 0], [0, 1, 0], [0, 0, 1]]
 
-        # Clean matrix data - convert empty strings to 0
-        cleaned_matrix = []
-        for row in matrix_data:
-            cleaned_row = []
-            for cell in row:
-                if cell == '' or cell is None:
-                    cleaned_row.append(0)
-                else:
-                    try:
-                        cleaned_row.append(float(cell))
-                    except (ValueError, TypeError):
-                        cleaned_row.append(0)
-            cleaned_matrix.append(cleaned_row)
-
-        matrix = np.array(cleaned_matrix, dtype=float)
+        if is_sparse(matrix_data):
+            return sparse_calculation(matrix_data, action, options)
+
+        matrix = parse_matrix(matrix_data, stack=True)
 
         # Validate matrix
         if matrix.size == 0:
             raise ValueError("Matrix cannot be empty")
 
+        if matrix.ndim == 3:
+            # A stack of same-shaped matrices, computed in one batched call
+            return stack_calculation(matrix, action, options)
+
         if action == 'det':
-            if matrix.shape[0] != matrix.shape[1]:
-                raise ValueError("Matrix must be square for determinant calculation")
-            return float(np.linalg.det(matrix))
+            require_square(matrix, "determinant calculation")
+            return determinant(matrix)
         elif action == 'inv':
-            if matrix.shape[0] != matrix.shape[1]:
-                raise ValueError("Matrix must be square for inverse calculation")
-            det = np.linalg.det(matrix)
-            if abs(det) < 1e-10:
-                raise ValueError("Matrix is singular (non-invertible)")
-            return np.linalg.inv(matrix)
+            require_square(matrix, "inverse calculation")
+            return inverse(matrix)
+        elif action == 'solve':
+            require_square(matrix, "solving a linear system")
+            rhs = (options or {}).get('b')
+            if rhs is None:
+                raise ValueError("Solving a linear system requires a right-hand side b")
+            return solve(matrix, parse_vector(rhs))
         elif action == 'rank':
             return int(np.linalg.matrix_rank(matrix))
         elif action == 'transpose':
             return matrix.T
+        elif action == 'lu':
+            require_square(matrix, "LU decomposition")
+            return lu(matrix)
+        elif action == 'qr':
+            return qr(matrix)
+        elif action == 'svd':
+            return svd(matrix)
+        elif action == 'eigh':
+            require_square(matrix, "eigenvalue calculation")
+            return eigh(matrix)
         elif action == 'eigenvalues':
-            if matrix.shape[0] != matrix.shape[1]:
-                raise ValueError("Matrix must be square for eigenvalue calculation")
-            eigenvals = np.linalg.eigvals(matrix)
-            # Handle complex eigenvalues
-            result = []
-            for val in eigenvals:
-                if np.isreal(val):
-                    result.append(float(val.real))
-                else:
-                    result.append(f"{val.real:.6f} + {val.imag:.6f}i")
-            return result
+            require_square(matrix, "eigenvalue calculation")
+            return eigenvalues(matrix, (options or {}).get('eigenvectors', False))
         elif action == 'trace':
-            if matrix.shape[0] != matrix.shape[1]:
-                raise ValueError("Matrix must be square for trace calculation")
+            require_square(matrix, "trace calculation")
             return float(np.trace(matrix))
         else:
             return f"Unknown matrix operation: {action}"
@@ -479,46 +763,58 @@ def handle_matrix_calculation(matrix_data, action, expression=''):
         raise ValueError(f"Matrix calculation error: {str(e)}")
 
 
-def handle_graph_calculation(expression, action):
-    """Handle graph operations with improved function parsing"""
+def handle_graph_calculation(expression, action, options=None):
+    """Handle graph operations with improved function parsing
+
+    options may carry x_min, x_max, num_points, sampling ('uniform' or 'adaptive')
+    and width, the pixel width the series is decimated to before it is returned.
+    A functions list plots several curves over one shared x grid.
+    """
     try:
         if action == 'plot':
-            # Clean function expression
-            func_expr = expression.replace('f(x)=', '').replace('f(x) =', '').strip()
-
-            if not func_expr:
-                return {"error": "Please enter a function"}
+            options = options or {}
+            functions = options.get('functions')
+            multiple = isinstance(functions, list)
+            if not multiple:
+                functions = [expression]
 
-            # Validate and parse function
-            validated_expr = validate_and_clean_function(func_expr)
+            # Clean function expressions
+            func_exprs = [str(func).replace('f(x)=', '').replace('f(x) =', '').strip() for func in functions]
 
-            # Generate sample data for plotting with better range
-            x_values = []
-            y_values = []
-
-            # Use more points for smoother curves
-            num_points = 300
-            x_min, x_max = -10, 10
+            if not func_exprs or not all(func_exprs):
+                return {"error": "Please enter a function"}
+            if len(func_exprs) > GRAPH_MAX_FUNCTIONS:
+                raise ValueError(f"At most {GRAPH_MAX_FUNCTIONS} functions can be plotted at once")
 
-            for i in range(num_points + 1):
-                x = x_min + (i / num_points) * (x_max - x_min)
-                x_values.append(x)
+            # Validate and compile every function once for the whole grid
+            compiled = [compile_function(func_expr) for func_expr in func_exprs]
 
-                try:
-                    y = evaluate_function(validated_expr, x)
-                    # Check for reasonable y values
-                    if abs(y) > 1e6:  # Cap extremely large values
-                        y_values.append(None)
-                    else:
-                        y_values.append(y)
-                except:
-                    y_values.append(None)
+            x_min, x_max, num_points, sampling, width = parse_graph_options(options)
+            sampler = adaptive_sample if sampling == 'adaptive' else uniform_sample
+            x_values, y_values, invalid = sampler(
+                lambda x: sample_functions(compiled, x), x_min, x_max, num_points
+            )
+            if width:
+                x_values, y_values, invalid = decimate_minmax(x_values, y_values, invalid, width)
+
+            y_lists = np.where(invalid, None, y_values).tolist()
+
+            if multiple:
+                return {
+                    'type': 'graph_data',
+                    'x_values': x_values.tolist(),
+                    'series': [
+                        {'expression': func_expr, 'y_values': y_list}
+                        for func_expr, y_list in zip(func_exprs, y_lists)
+                    ],
+                    'success': True
+                }
 
             return {
                 'type': 'graph_data',
-                'x_values': x_values,
-                'y_values': y_values,
-                'expression': func_expr,
+                'x_values': x_values.tolist(),
+                'y_values': y_lists[0],
+                'expression': func_exprs[0],
                 'success': True
             }
         else:
@@ -528,68 +824,128 @@ def handle_graph_calculation(expression, action):
         return {"error": f"Graph calculation error: {str(e)}", "success": False}
 
 
-def validate_and_clean_function(func_expr):
-    """Validate and clean function expression for safe evaluation"""
-    # Remove dangerous functions and keywords
-    dangerous_patterns = [
-        'import', 'exec', 'eval', 'open', 'file', 'input', 'raw_input',
-        '__', 'lambda', 'def', 'class', 'for', 'while', 'if', 'else',
-        'try', 'except', 'with', 'assert', 'del', 'global', 'nonlocal'
-    ]
-
-    func_lower = func_expr.lower()
-    for pattern in dangerous_patterns:
-        if pattern in func_lower:
-            raise ValueError(f"Invalid function: contains '{pattern}'")
-
-    # Replace common mathematical expressions
-    replacements = [
-        (r'\^', '**'),  # Power operator
-        (r'\bpi\b', str(math.pi)),
-        (r'\be\b(?!\w)', str(math.e)),  # e but not part of other words
-        (r'\babs\(', 'abs('),
-    ]
+# Functions available in graph expressions, scalar and vectorized over NumPy arrays
+GRAPH_FUNCTIONS = {
+    'sin': math.sin,
+    'cos': math.cos,
+    'tan': math.tan,
+    'asin': math.asin,
+    'acos': math.acos,
+    'atan': math.atan,
+    'sinh': math.sinh,
+    'cosh': math.cosh,
+    'tanh': math.tanh,
+    'log': math.log10,
+    'ln': math.log,
+    'sqrt': math.sqrt,
+    'exp': math.exp,
+    'abs': abs,
+    'ceil': math.ceil,
+    'floor': math.floor,
+    'round': round,
+    'pow': pow,
+}
+
+VECTOR_FUNCTIONS = {
+    'sin': np.sin,
+    'cos': np.cos,
+    'tan': np.tan,
+    'asin': np.arcsin,
+    'acos': np.arccos,
+    'atan': np.arctan,
+    'sinh': np.sinh,
+    'cosh': np.cosh,
+    'tanh': np.tanh,
+    'log': np.log10,
+    'ln': np.log,
+    'sqrt': np.sqrt,
+    'exp': np.exp,
+    'abs': np.abs,
+    'ceil': np.ceil,
+    'floor': np.floor,
+    'round': np.round,
+    'pow': np.power,
+}
+
+GRAPH_CONSTANTS = {
+    'pi': math.pi,
+    'e': math.e,
+}
+
+# Points with |y| above this are dropped from plots
+GRAPH_Y_LIMIT = 1e6
+
+GRAPH_SAMPLING_MODES = ('uniform', 'adaptive')
+
+GRAPH_MAX_FUNCTIONS = 10
+
+
+def parse_graph_options(options):
+    """Validate the plot range, point budget, sampling mode and decimation width of a graph request"""
+    try:
+        x_min = float(options.get('x_min', -10))
+        x_max = float(options.get('x_max', 10))
+        num_points = int(options.get('num_points', 300))
+        width = int(options.get('width') or 0)
+    except (TypeError, ValueError):
+        raise ValueError("x_min, x_max, num_points and width must be numbers")
+
+    if not (math.isfinite(x_min) and math.isfinite(x_max)) or x_min >= x_max:
+        raise ValueError("x_min must be less than x_max")
+
+    max_points = getattr(settings, 'KCALC_GRAPH_MAX_POINTS', 100000)
+    if not 2 <= num_points <= max_points:
+        raise ValueError(f"num_points must be between 2 and {max_points}")
+
+    sampling = options.get('sampling', 'uniform')
+    if sampling not in GRAPH_SAMPLING_MODES:
+        raise ValueError(f"Unknown sampling mode: {sampling}")
+
+    if width < 0:
+        raise ValueError("width must be positive")
+
+    return x_min, x_max, num_points, sampling, width
+
+
+def compile_function(func_expr, vectorized=True):
+    """Compile a function of x, reusing the shared expression cache"""
+    expression = normalize_expression(func_expr)
+    key = (expression, 'vector' if vectorized else 'scalar')
+    compiled = expression_cache.get(key)
+    if compiled is None:
+        functions = VECTOR_FUNCTIONS if vectorized else GRAPH_FUNCTIONS
+        tree = parse_expression(expression)
+        limit_expression_cost(tree)
+        func = compile_expression(tree, AdvancedCalculator.OPERATORS, functions, GRAPH_CONSTANTS, variables=('x',))
+        compiled = CompiledExpression(func, constant=False)
+        expression_cache.set(key, compiled)
+    return compiled
+
+
+def sample_function(compiled, x_values):
+    """Evaluate a vectorized function over an x array, returning y and a mask of unplottable points"""
+    with np.errstate(all='ignore'):
+        try:
+            y_values = np.asarray(compiled({'x': x_values}), dtype=float)
+        except (ArithmeticError, ValueError, TypeError):
+            # Only constant sub-expressions can raise here, so no point is plottable
+            y_values = np.full(x_values.shape, np.nan)
+        y_values = np.broadcast_to(y_values, x_values.shape)
+        invalid = ~np.isfinite(y_values) | (np.abs(y_values) > GRAPH_Y_LIMIT)
+    return y_values, invalid
 
-    cleaned = func_expr
-    for pattern, replacement in replacements:
-        cleaned = re.sub(pattern, replacement, cleaned)
 
-    return cleaned
+def sample_functions(compiled_functions, x_values):
+    """Evaluate several vectorized functions over a shared x array, one row per function"""
+    samples = [sample_function(compiled, x_values) for compiled in compiled_functions]
+    return np.vstack([y for y, _ in samples]), np.vstack([mask for _, mask in samples])
 
 
 def evaluate_function(expression, x_value):
     """Safely evaluate mathematical function at given x value"""
-    # Replace x with the actual value
-    expr = expression.replace('x', f'({x_value})')
-
-    # Define safe mathematical functions
-    safe_dict = {
-        'sin': math.sin,
-        'cos': math.cos,
-        'tan': math.tan,
-        'asin': math.asin,
-        'acos': math.acos,
-        'atan': math.atan,
-        'sinh': math.sinh,
-        'cosh': math.cosh,
-        'tanh': math.tanh,
-        'log': math.log10,
-        'ln': math.log,
-        'sqrt': math.sqrt,
-        'exp': math.exp,
-        'abs': abs,
-        'ceil': math.ceil,
-        'floor': math.floor,
-        'round': round,
-        'pi': math.pi,
-        'e': math.e,
-        'pow': pow,
-    }
-
-    # Evaluate with restricted builtins
     try:
-        result = eval(expr, {"__builtins__": {}}, safe_dict)
-        return float(result)
+        compiled = compile_function(expression, vectorized=False)
+        return float(compiled({'x': x_value}))
     except:
         raise ValueError("Cannot evaluate function at this point")
 
@@ -600,23 +956,9 @@ def preferences_api(request):
     if request.method == 'GET':
         user, session_key = get_user_session(request)
 
-        prefs, created = UserPreferences.objects.get_or_create(
-            user=user,
-            session_key=session_key,
-            defaults={
-                'theme': 'dark',
-                'decimal_places': 10,
-                'angle_unit': 'rad',
-                'memory_value': 0
-            }
-        )
+        prefs = get_preferences(user, session_key)
 
-        return JsonResponse({
-            'theme': prefs.theme,
-            'decimal_places': prefs.decimal_places,
-            'angle_unit': prefs.angle_unit,
-            'memory_value': float(prefs.memory_value)
-        })
+        return JsonResponse(preferences_data(prefs))
 
     elif request.method == 'POST':
         try:
@@ -628,17 +970,12 @@ def preferences_api(request):
                 session_key=session_key
             )
 
-            # Update preferences
-            if 'theme' in data:
-                prefs.theme = data['theme']
-            if 'decimal_places' in data:
-                prefs.decimal_places = int(data['decimal_places'])
-            if 'angle_unit' in data:
-                prefs.angle_unit = data['angle_unit']
-            if 'memory_value' in data:
-                prefs.memory_value = Decimal(str(data['memory_value']))
-
-            prefs.save()
+            # Only the posted fields are written, a full save would undo concurrent memory_api updates
+            fields = update_preferences(prefs, data)
+            prefs.save(update_fields=fields)
+            if 'memory_value' not in fields:
+                prefs.refresh_from_db(fields=['memory_value'])
+            cache_preferences(prefs)
 
             return JsonResponse({'success': True})
 
@@ -649,48 +986,158 @@ def preferences_api(request):
         return JsonResponse({'error': 'Method not allowed'}, status=405)
 
 
+def preferences_data(prefs):
+    return {
+        'theme': prefs.theme,
+        'decimal_places': prefs.decimal_places,
+        'angle_unit': prefs.angle_unit,
+        'memory_value': float(prefs.memory_value)
+    }
+
+
+def update_preferences(prefs, data):
+    """Apply the fields present in a preferences POST body, returning their names"""
+    fields = []
+    if 'theme' in data:
+        prefs.theme = data['theme']
+        fields.append('theme')
+    if 'decimal_places' in data:
+        prefs.decimal_places = int(data['decimal_places'])
+        fields.append('decimal_places')
+    if 'angle_unit' in data:
+        prefs.angle_unit = data['angle_unit']
+        fields.append('angle_unit')
+    if 'memory_value' in data:
+        prefs.memory_value = Decimal(str(data['memory_value']))
+        fields.append('memory_value')
+    return fields
+
+
 def history_api(request):
-    """API endpoint for calculation history"""
+    """API endpoint for calculation history
+
+    Passing a cursor parameter (empty for the first page) switches to keyset
+    pagination, which skips the COUNT(*) unless count=1 is also given.
+    search matches word prefixes; order=relevance ranks page-number results.
+    """
     user, session_key = get_user_session(request)
+    flush_history()
 
     if user:
         history = CalculationHistory.objects.filter(user=user)
     else:
         history = CalculationHistory.objects.filter(session_key=session_key)
 
-    # Search functionality
-    search_query = request.GET.get('search', '').strip()
-    if search_query:
-        history = history.filter(
-            Q(expression__icontains=search_query) |
-            Q(result__icontains=search_query)
-        )
-
     # Pagination
     page_number = request.GET.get('page', 1)
-    items_per_page = min(int(request.GET.get('per_page', 20)), 100)
-
-    paginator = Paginator(history.order_by('-timestamp'), items_per_page)
-    page_obj = paginator.get_page(page_number)
-
-    history_data = []
-    for calc in page_obj:
-        history_data.append({
-            'id': calc.id,
-            'expression': calc.expression,
-            'result': calc.result,
-            'type': calc.calculation_type,
-            'timestamp': calc.timestamp.isoformat(),
-        })
+    items_per_page = max(min(int(request.GET.get('per_page', 20)), 100), 1)
 
-    return JsonResponse({
-        'history': history_data,
+    # Search functionality
+    search_query = request.GET.get('search', '').strip()
+
+    if search_query and request.GET.get('order') == 'relevance':
+        # Rank matches once, then load only the rows on the requested page
+        paginator = Paginator(ranked_history_ids(history, search_query, user, session_key), items_per_page)
+        page_obj = paginator.get_page(page_number)
+        rows = history.in_bulk(page_obj.object_list)
+        page_rows = [rows[pk] for pk in page_obj.object_list if pk in rows]
+    else:
+        if search_query:
+            history = search_history(history, search_query, user, session_key)
+
+        if 'cursor' in request.GET:
+            try:
+                return JsonResponse(history_cursor_page(
+                    history, request.GET['cursor'], items_per_page, request.GET.get('count') in ('1', 'true')
+                ))
+            except ValueError as e:
+                return JsonResponse({'error': str(e)}, status=400)
+
+        paginator = Paginator(history.order_by('-timestamp'), items_per_page)
+        page_obj = paginator.get_page(page_number)
+        page_rows = page_obj
+
+    return JsonResponse(history_page_data(page_rows, page_obj, paginator))
+
+
+def history_page_data(page_rows, page_obj, paginator):
+    return {
+        'history': [
+            {
+                'id': calc.id,
+                'expression': calc.expression,
+                'result': calc.result,
+                'type': calc.calculation_type,
+                'timestamp': calc.timestamp.isoformat(),
+            }
+            for calc in page_rows
+        ],
         'has_next': page_obj.has_next(),
         'has_previous': page_obj.has_previous(),
         'total_pages': paginator.num_pages,
         'current_page': page_obj.number,
         'total_count': paginator.count,
-    })
+    }
+
+
+def history_cursor_page(history, cursor, items_per_page, with_count=False):
+    """Build one keyset-paginated page of history, newest first, ordered by (timestamp, id)"""
+    rows = list(history_cursor_rows(history, cursor, items_per_page))
+    data = history_cursor_data(rows, items_per_page)
+
+    if with_count:
+        data['total_count'] = history.count()
+
+    return data
+
+
+def history_cursor_rows(history, cursor, items_per_page):
+    """Query the rows of a keyset page, plus one extra row telling whether another page follows"""
+    page = history.order_by('-timestamp', '-id')
+
+    if cursor:
+        timestamp, pk = decode_history_cursor(cursor)
+        page = page.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=pk))
+
+    return page.values('id', 'expression', 'result', 'calculation_type', 'timestamp')[:items_per_page + 1]
+
+
+def history_cursor_data(rows, items_per_page):
+    has_next = len(rows) > items_per_page
+    rows = rows[:items_per_page]
+
+    return {
+        'history': [
+            {
+                'id': row['id'],
+                'expression': row['expression'],
+                'result': row['result'],
+                'type': row['calculation_type'],
+                'timestamp': row['timestamp'].isoformat(),
+            }
+            for row in rows
+        ],
+        'has_next': has_next,
+        'next_cursor': encode_history_cursor(rows[-1]['timestamp'], rows[-1]['id']) if has_next else None,
+    }
+
+
+def encode_history_cursor(timestamp, pk):
+    """Encode the position after a history row as an opaque cursor string"""
+    return urlsafe_b64encode(f"{timestamp.isoformat()}|{pk}".encode()).decode().rstrip('=')
+
+
+def decode_history_cursor(cursor):
+    """Decode a cursor from encode_history_cursor into (timestamp, id)"""
+    try:
+        raw = urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        timestamp, pk = raw.split('|')
+        timestamp = parse_datetime(timestamp)
+        if timestamp is None:
+            raise ValueError
+        return timestamp, int(pk)
+    except ValueError:
+        raise ValueError("Invalid cursor")
 
 
 @csrf_exempt
@@ -700,6 +1147,8 @@ def clear_history_api(request):
         return JsonResponse({'error': 'POST method required'}, status=405)
 
     user, session_key = get_user_session(request)
+    # Queued rows would otherwise reappear after the delete
+    flush_history()
 
     if user:
         deleted_count, _ = CalculationHistory.objects.filter(user=user).delete()
@@ -722,24 +1171,241 @@ def memory_api(request):
 
         user, session_key = get_user_session(request)
 
-        prefs, created = UserPreferences.objects.get_or_create(
-            user=user,
-            session_key=session_key,
-            defaults={'memory_value': 0}
+        memory_value = memory_update(action, value)
+
+        prefs = get_preferences(user, session_key)
+        if memory_value is not None:
+            if not UserPreferences.objects.filter(pk=prefs.pk).update(memory_value=memory_value):
+                # The cached row is gone, recreate it and apply the operation once more
+                invalidate_preferences(user, session_key)
+                prefs = get_preferences(user, session_key)
+                UserPreferences.objects.filter(pk=prefs.pk).update(memory_value=memory_value)
+
+        prefs.memory_value = UserPreferences.objects.values_list('memory_value', flat=True).get(pk=prefs.pk)
+        cache_preferences(prefs)
+
+        if action == 'recall':
+            return JsonResponse({'value': float(prefs.memory_value)})
+
+        return JsonResponse({
+            'success': True,
+            'memory_value': float(prefs.memory_value)
+        })
+
+    except Exception as e:
+        return JsonResponse({'error': str(e), 'success': False}, status=400)
+
+
+def memory_update(action, value):
+    """Database expression for the new memory value, or None for actions that only read it
+
+    Each operation is a single UPDATE evaluated by the database, so
+    concurrent requests from several tabs never lose an update.
+    """
+    if action == 'store':
+        return Value(Decimal(str(value)))
+    if action == 'clear':
+        return Value(Decimal('0'))
+    if action == 'add':
+        return F('memory_value') + Decimal(str(value))
+    if action == 'subtract':
+        return F('memory_value') - Decimal(str(value))
+    return None
+
+
+@csrf_exempt
+def timing_api(request):
+    """Aggregated request timings and cache statistics of this process, for staff or in DEBUG
+
+    DELETE clears the timings.
+    """
+    if not (settings.DEBUG or request.user.is_staff):
+        return JsonResponse({'error': 'Staff access required'}, status=403)
+
+    if request.method == 'DELETE':
+        timing_stats.reset()
+        return JsonResponse({'success': True})
+
+    return JsonResponse({
+        'enabled': timing_enabled(),
+        'requests': timing_stats.as_list(),
+        'expression_cache': expression_cache.stats(),
+        'preferences_cache': preferences_cache_stats.as_dict(),
+        'history_writer': history_writer.stats(),
+        'sandbox': sandbox_stats(),
+    })
+
+
+# Async variants of the API views, routed instead of the sync ones when
+# KCALC_ASYNC_VIEWS is set (config.asgi sets it). They use the async ORM and
+# cache APIs, and run expression evaluation in evaluation_executor so that
+# CPU-bound work never blocks the event loop.
+
+evaluation_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'KCALC_EVALUATION_WORKERS', None),
+    thread_name_prefix='kcalc-evaluation'
+)
+
+
+async def aget_user_session(request):
+    """Async version of get_user_session"""
+    user = await request.auser()
+    if user.is_authenticated:
+        return user, None
+    if not request.session.session_key:
+        await request.session.acreate()
+    return None, request.session.session_key
+
+
+@csrf_exempt
+async def acalculate_api(request):
+    """Async version of calculate_api"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST method required'}, status=405)
+
+    try:
+        with span('parse'):
+            data = json.loads(request.body)
+        calc_type = data.get('type', 'basic')
+        action = data.get('action', 'calculate')
+        tag(calc_type, action)
+
+        user, session_key = await aget_user_session(request)
+        prefs = await aget_preferences(user, session_key)
+
+        # Run in a copy of this context so that timing spans reach the request
+        expression, formatted_result = await asyncio.get_running_loop().run_in_executor(
+            evaluation_executor, contextvars.copy_context().run,
+            run_calculation, data, prefs.angle_unit, prefs.decimal_places
         )
 
-        if action == 'store':
-            prefs.memory_value = Decimal(str(value))
-        elif action == 'recall':
+        if action not in MEMORY_ACTIONS:
+            await arecord_history([CalculationHistory(
+                user=user,
+                session_key=session_key,
+                expression=expression,
+                result=history_result(formatted_result),
+                calculation_type=calc_type
+            )])
+
+        with span('encode'):
+            return JsonResponse({
+                'result': formatted_result,
+                'expression': expression,
+                'success': True
+            })
+
+    except Exception as e:
+        return JsonResponse({
+            'error': str(e),
+            'success': False
+        }, status=400)
+
+
+@csrf_exempt
+async def apreferences_api(request):
+    """Async version of preferences_api"""
+    if request.method == 'GET':
+        user, session_key = await aget_user_session(request)
+        prefs = await aget_preferences(user, session_key)
+        return JsonResponse(preferences_data(prefs))
+
+    elif request.method == 'POST':
+        try:
+            data = json.loads(request.body)
+            user, session_key = await aget_user_session(request)
+
+            prefs, created = await UserPreferences.objects.aget_or_create(
+                user=user,
+                session_key=session_key
+            )
+
+            fields = update_preferences(prefs, data)
+            await prefs.asave(update_fields=fields)
+            if 'memory_value' not in fields:
+                await prefs.arefresh_from_db(fields=['memory_value'])
+            await acache_preferences(prefs)
+
+            return JsonResponse({'success': True})
+
+        except Exception as e:
+            return JsonResponse({'error': str(e), 'success': False}, status=400)
+
+    else:
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+
+async def ahistory_api(request):
+    """Async version of history_api"""
+    user, session_key = await aget_user_session(request)
+    await aflush_history()
+
+    if user:
+        history = CalculationHistory.objects.filter(user=user)
+    else:
+        history = CalculationHistory.objects.filter(session_key=session_key)
+
+    page_number = request.GET.get('page', 1)
+    items_per_page = max(min(int(request.GET.get('per_page', 20)), 100), 1)
+    search_query = request.GET.get('search', '').strip()
+
+    if search_query and request.GET.get('order') == 'relevance':
+        # Ranking runs a raw query on the connection, which has no async API
+        ids = await sync_to_async(ranked_history_ids)(history, search_query, user, session_key)
+        paginator = Paginator(ids, items_per_page)
+        page_obj = paginator.get_page(page_number)
+        rows = await history.ain_bulk(page_obj.object_list)
+        page_rows = [rows[pk] for pk in page_obj.object_list if pk in rows]
+    else:
+        if search_query:
+            # May look up whether the search index exists on first use
+            history = await sync_to_async(search_history)(history, search_query, user, session_key)
+
+        if 'cursor' in request.GET:
+            try:
+                rows = [row async for row in history_cursor_rows(history, request.GET['cursor'], items_per_page)]
+            except ValueError as e:
+                return JsonResponse({'error': str(e)}, status=400)
+            data = history_cursor_data(rows, items_per_page)
+            if request.GET.get('count') in ('1', 'true'):
+                data['total_count'] = await history.acount()
+            return JsonResponse(data)
+
+        paginator = Paginator(history.order_by('-timestamp'), items_per_page)
+        # Paginator only counts synchronously; fill in its cached count first
+        paginator.count = await history.acount()
+        page_obj = paginator.get_page(page_number)
+        page_rows = [calc async for calc in page_obj.object_list]
+
+    return JsonResponse(history_page_data(page_rows, page_obj, paginator))
+
+
+@csrf_exempt
+async def amemory_api(request):
+    """Async version of memory_api"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'POST method required'}, status=405)
+
+    try:
+        data = json.loads(request.body)
+        action = data.get('action', '')
+        value = data.get('value', 0)
+
+        user, session_key = await aget_user_session(request)
+        memory_value = memory_update(action, value)
+
+        prefs = await aget_preferences(user, session_key)
+        if memory_value is not None:
+            if not await UserPreferences.objects.filter(pk=prefs.pk).aupdate(memory_value=memory_value):
+                await ainvalidate_preferences(user, session_key)
+                prefs = await aget_preferences(user, session_key)
+                await UserPreferences.objects.filter(pk=prefs.pk).aupdate(memory_value=memory_value)
+
+        prefs.memory_value = await UserPreferences.objects.values_list('memory_value', flat=True).aget(pk=prefs.pk)
+        await acache_preferences(prefs)
+
+        if action == 'recall':
             return JsonResponse({'value': float(prefs.memory_value)})
-        elif action == 'clear':
-            prefs.memory_value = Decimal('0')
-        elif action == 'add':
-            prefs.memory_value += Decimal(str(value))
-        elif action == 'subtract':
-            prefs.memory_value -= Decimal(str(value))
-
-        prefs.save()
 
         return JsonResponse({
             'success': True,
@@ -362,6 +362,14 @@
                 // 1D array
                 content += `[${result.map(val => window.formatNumber(val)).join(', ')}]`;
             }
+        } else if (result && Array.isArray(result.real) && Array.isArray(result.imag)) {
+            // Eigenvalues come as separate real and imaginary parts
+            const values = result.real.map((re, i) => {
+                const im = result.imag[i];
+                if (!im) return window.formatNumber(re);
+                return `${window.formatNumber(re)} ${im < 0 ? '-' : '+'} ${window.formatNumber(Math.abs(im))}i`;
+            });
+            content = `<strong>${operation}:</strong><br>[${values.join(', ')}]`;
         } else {
             content = `<strong>${operation}:</strong> ${window.formatNumber(result)}`;
         }